@@ -0,0 +1,375 @@
+"""
+Benchmarks for the hot paths of `canvas_requests.py` and `canvas_analyzer.py`.
+
+Run with `python benchmark_canvas.py` to time, on synthetic courses:
+
+* cache lookups against a synthetic cache of one million responses,
+* joining submissions with their assignment groups, as dictionaries and as
+  compact records,
+* reading a course back out of the cache with `_get_via_cache` and
+  `get_submissions`,
+* building a `GradeReport`, each summary, and the grade trends,
+* rendering both plots (skipped if matplotlib is not installed),
+
+reporting the time, throughput, and peak memory of each. Use `--help` to
+change the size and shape of the synthetic courses.
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import canvas_analyzer
+import canvas_requests
+
+
+def build_cache(database, rows, urls_per_user=20):
+    '''
+    Fills a fresh responses table with synthetic cached responses.
+
+    Params:
+        database (sqlite3.Connection): An empty database to fill
+        rows (int): How many responses to store
+        urls_per_user (int): How many URLs each synthetic user has cached
+    Returns:
+        list: The (url, user) keys that were stored
+    '''
+    database.execute("CREATE TABLE responses (url text, user text, response text)")
+    keys = [("courses/{}/assignment_groups".format(index % urls_per_user),
+             "user{}".format(index // urls_per_user))
+            for index in range(rows)]
+    database.executemany("INSERT INTO responses VALUES (?, ?, '[]')",
+                         ((url, user) for url, user in keys))
+    database.commit()
+    return keys
+
+
+def time_lookups(database, keys, lookups):
+    '''
+    Times random cache lookups with `canvas_requests._lookup_response`.
+
+    Params:
+        database (sqlite3.Connection): The cache to query
+        keys (list): The (url, user) keys to choose lookups from
+        lookups (int): How many lookups to time
+    Returns:
+        float: The mean seconds per lookup
+    '''
+    sample = random.Random(0).choices(keys, k=lookups)
+    start = time.perf_counter()
+    for url, user in sample:
+        canvas_requests._lookup_response(database, url, user)
+    return (time.perf_counter() - start) / lookups
+
+
+def bench_cache_lookup(rows=1000000, lookups=2000):
+    '''
+    Compares cache lookup latency before and after `_ensure_cache_index`.
+
+    Params:
+        rows (int): How many responses the synthetic cache holds
+        lookups (int): How many lookups to time for each case
+    Returns:
+        dict: Mean microseconds per lookup, keyed 'unindexed' and 'indexed'
+    '''
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    try:
+        database = sqlite3.connect(path)
+        keys = build_cache(database, rows)
+        # A full table scan per lookup is slow, so time fewer of them
+        unindexed = time_lookups(database, keys, max(1, lookups // 100))
+        canvas_requests._ensure_cache_index(database)
+        indexed = time_lookups(database, keys, lookups)
+        database.close()
+    finally:
+        os.remove(path)
+    return {'unindexed': unindexed * 1e6, 'indexed': indexed * 1e6}
+
+
+def make_course(assignments=100000, students=1, groups=6, graded=0.8, seed=0):
+    '''
+    Makes the JSON text of a synthetic course, shaped like Canvas' responses.
+    Every student has one submission for every assignment.
+
+    Params:
+        assignments (int): How many assignments the course has
+        students (int): How many students the course has
+        groups (int): How many assignment groups the course has
+        graded (float): The chance that a submission has been graded
+        seed (int): Seed for the random scores
+    Returns:
+        tuple: The submissions JSON text and the assignment groups JSON text
+    '''
+    chance = random.Random(seed)
+    group_list = [{'id': index, 'name': 'Group {}'.format(index),
+                   'group_weight': 100 // groups, 'rules': {}}
+                  for index in range(groups)]
+    assignment_list = [{'id': index, 'name': 'Assignment {}'.format(index),
+                        'points_possible': float(chance.choice([5, 10, 20, 100])),
+                        'due_at': '2017-{:02d}-{:02d}T16:20:00Z'.format(
+                            8 + index * 4 // assignments, 1 + index % 28),
+                        'unlock_at': None, 'lock_at': None,
+                        'assignment_group_id': index % groups}
+                       for index in range(assignments)]
+    submission_list = []
+    for student in range(students):
+        for assignment in assignment_list:
+            points_possible = assignment['points_possible']
+            is_graded = chance.random() < graded
+            submission_list.append({
+                'assignment_id': assignment['id'], 'user_id': student, 'attempt': 1,
+                'score': chance.randint(0, int(points_possible)) if is_graded else None,
+                'workflow_state': 'graded' if is_graded else 'unsubmitted',
+                'submitted_at': None, 'graded_at': None, 'grader_id': None,
+                'late': False, 'missing': False, 'excused': None, 'seconds_late': 0,
+                'assignment': assignment})
+    return json.dumps(submission_list), json.dumps(group_list)
+
+
+def measure_memory(build, submissions_text, groups_text):
+    '''
+    Measures the memory held by the result of joining a decoded course.
+
+    Params:
+        build (function): Joins (submissions, groups) into the final result
+        submissions_text (str): The submissions JSON text
+        groups_text (str): The assignment groups JSON text
+    Returns:
+        int: Bytes still allocated once only the result is kept
+    '''
+    tracemalloc.start()
+    result = build(json.loads(submissions_text), json.loads(groups_text))
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_record_memory(texts):
+    '''
+    Compares the memory of `get_submissions` dictionaries against
+    `get_submission_records` records for one synthetic course.
+
+    Params:
+        texts (tuple): The submissions and groups JSON text, from make_course
+    Returns:
+        dict: Megabytes held, keyed 'dicts' and 'records'
+    '''
+    return {'dicts': measure_memory(canvas_requests._attach_groups, *texts) / 2**20,
+            'records': measure_memory(canvas_requests._build_records, *texts) / 2**20}
+
+
+def measure(function, items, repeat=3):
+    '''
+    Times a function and measures the most memory it allocates at once.
+    The timed runs are separate from the traced run, since tracing slows
+    Python down.
+
+    Params:
+        function (function): Does the work, taking no arguments
+        items (int): How many items (e.g., submissions) one call handles
+        repeat (int): How many timed runs to take the fastest of
+    Returns:
+        dict: 'seconds' for the fastest run, 'per_second' items handled per
+              second, and 'peak_mb' megabytes allocated at the peak
+    '''
+    seconds = min(_time_call(function) for _ in range(repeat))
+    tracemalloc.start()
+    try:
+        function()
+        size, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': seconds,
+            'per_second': items / seconds if seconds else float('inf'),
+            'peak_mb': peak / 2**20}
+
+
+def _time_call(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def bench_join(course, repeat=3):
+    '''
+    Times joining a decoded course's submissions with their groups.
+
+    Params:
+        course (tuple): The submissions and groups JSON text, from make_course
+        repeat (int): How many timed runs to take the fastest of
+    Returns:
+        dict: Measurements keyed by what was timed
+    '''
+    submissions_text, groups_text = course
+    items = len(json.loads(submissions_text))
+    return {
+        'join dicts': measure(lambda: canvas_requests._attach_groups(
+            json.loads(submissions_text), json.loads(groups_text)), items, repeat),
+        'join records': measure(lambda: canvas_requests._build_records(
+            json.loads(submissions_text), json.loads(groups_text)), items, repeat)}
+
+
+@contextlib.contextmanager
+def synthetic_cache(courses, user='benchmark'):
+    '''
+    Points `canvas_requests` at a temporary cache where one sample user has
+    the given synthetic courses cached.
+
+    Params:
+        courses (dict): Course IDs mapped to (submissions, groups) JSON text
+        user (str): The sample user the courses are cached for
+    Returns:
+        str: The sample user, for the duration of the `with` block
+    '''
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    database = sqlite3.connect(path)
+    database.execute("CREATE TABLE users (name text)")
+    database.execute("INSERT INTO users VALUES (?)", (user,))
+    database.execute("""CREATE TABLE responses
+                        (url text, user text, response text, fetched_at real)""")
+    for course_id, (submissions_text, groups_text) in courses.items():
+        database.executemany("INSERT INTO responses VALUES (?, ?, ?, NULL)",
+                             [(canvas_requests._submissions_url(course_id), user, submissions_text),
+                              (canvas_requests._groups_url(course_id), user, groups_text)])
+    database.commit()
+    database.close()
+    saved = (canvas_requests.DATABASE_NAME, canvas_requests._DATABASE,
+             canvas_requests._USERS)
+    canvas_requests.DATABASE_NAME = path
+    canvas_requests._DATABASE = canvas_requests._connect(path)
+    canvas_requests._USERS = None
+    canvas_requests.GROUP_INDEX.invalidate()
+    try:
+        yield user
+    finally:
+        canvas_requests.GROUP_INDEX.invalidate()
+        canvas_requests._DATABASE.close()
+        (canvas_requests.DATABASE_NAME, canvas_requests._DATABASE,
+         canvas_requests._USERS) = saved
+        os.remove(path)
+
+
+def bench_cache_get(course, repeat=3):
+    '''
+    Times reading a synthetic course back out of the cache.
+
+    Params:
+        course (tuple): The submissions and groups JSON text, from make_course
+        repeat (int): How many timed runs to take the fastest of
+    Returns:
+        dict: Measurements keyed by what was timed
+    '''
+    items = len(json.loads(course[0]))
+    url = canvas_requests._submissions_url(1)
+    with synthetic_cache({1: course}) as user:
+        return {
+            '_get_via_cache': measure(
+                lambda: canvas_requests._get_via_cache(url, user), items, repeat),
+            'get_submissions': measure(
+                lambda: canvas_requests.get_submissions(user, 1), items, repeat)}
+
+
+def bench_reports(submissions, repeat=3):
+    '''
+    Times each summary and the grade trends of one course.
+
+    Params:
+        submissions (list): The course's joined submissions
+        repeat (int): How many timed runs to take the fastest of
+    Returns:
+        dict: Measurements keyed by what was timed
+    '''
+    items = len(submissions)
+
+    def quietly(function):
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                function(submissions)
+        return run
+
+    return {
+        'GradeReport': measure(lambda: canvas_analyzer.GradeReport(submissions), items, repeat),
+        'summarize_points': measure(quietly(canvas_analyzer.summarize_points), items, repeat),
+        'summarize_groups': measure(quietly(canvas_analyzer.summarize_groups), items, repeat),
+        'trends': measure(lambda: canvas_analyzer.GradeReport(submissions).trends(), items, repeat),
+        'compute_trends': measure(lambda: canvas_analyzer.compute_trends(submissions), items, repeat)}
+
+
+def bench_plots(submissions, repeat=1):
+    '''
+    Times rendering both plots of one course to PNG files, headless.
+
+    Params:
+        submissions (list): The course's joined submissions
+        repeat (int): How many timed runs to take the fastest of
+    Returns:
+        dict: Measurements keyed by what was timed, or nothing if
+              matplotlib is not installed
+    '''
+    if importlib.util.find_spec("matplotlib") is None:
+        return {}
+    items = len(submissions)
+    report = canvas_analyzer.GradeReport(submissions)
+    # Plots saved to a file are drawn without a display
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'plot.png')
+        return {
+            'plot_scores': measure(
+                lambda: canvas_analyzer.plot_scores(report, filename), items, repeat),
+            'plot_grade_trends': measure(
+                lambda: canvas_analyzer.plot_grade_trends(report, filename), items, repeat)}
+
+
+def print_results(title, results):
+    print(title)
+    for name, result in results.items():
+        print("    {:>18}: {:10.4f} s {:14,.0f} items/s {:10.1f} MB peak".format(
+            name, result['seconds'], result['per_second'], result['peak_mb']))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000000,
+                        help="cached responses for the lookup benchmark (0 skips it)")
+    parser.add_argument('--assignments', type=int, default=2000)
+    parser.add_argument('--students', type=int, default=50)
+    parser.add_argument('--groups', type=int, default=6)
+    parser.add_argument('--graded', type=float, default=0.8,
+                        help="chance that a submission has been graded")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="timed runs to take the fastest of")
+    parser.add_argument('--no-plots', action='store_true')
+    options = parser.parse_args(arguments)
+    if options.rows:
+        results = bench_cache_lookup(options.rows)
+        print("Cache lookup with {} cached responses:".format(options.rows))
+        for name, micros in results.items():
+            print("    {:>18}: {:10.1f} us/lookup".format(name, micros))
+    course = make_course(options.assignments, options.students, options.groups,
+                         options.graded)
+    submissions = canvas_requests._attach_groups(*map(json.loads, course))
+    print("Synthetic course: {} students x {} assignments = {} submissions".format(
+        options.students, options.assignments, len(submissions)))
+    results = bench_record_memory(course)
+    print("Memory held by the joined course:")
+    for name, megabytes in results.items():
+        print("    {:>18}: {:10.1f} MB".format(name, megabytes))
+    print_results("Joining:", bench_join(course, options.repeat))
+    print_results("Reading from the cache:", bench_cache_get(course, options.repeat))
+    print_results("Summaries and trends:", bench_reports(submissions, options.repeat))
+    if not options.no_plots:
+        print_results("Plots:", bench_plots(submissions))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,8 +14,11 @@ Refer to the instructions on Canvas for more information.
 author: SWETHA SANKAR
 """
 import canvas_requests
-import matplotlib.pyplot as plt
 import datetime
+import functools
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 __version__ = 7
 
@@ -30,11 +33,16 @@ def main(user_id: str):
     print_user_info(canvas_requests.get_user(user_id))
     courses = filter_available_courses(canvas_requests.get_courses(user_id))
     print_courses(courses)
-    chosen = choose_course(get_course_ids(courses))
-    summarize_points(canvas_requests.get_submissions(user_id, chosen))
-    summarize_groups(canvas_requests.get_submissions(user_id, chosen))
-    plot_scores(canvas_requests.get_submissions(user_id, chosen))
-    plot_grade_trends(canvas_requests.get_submissions(user_id, chosen))
+    course_ids = get_course_ids(courses)
+    # While the user picks a course, the first few can be fetched in the background (see configure_prefetch)
+    with canvas_requests.CoursePrefetcher(user_id, course_ids[:PREFETCH_COURSES], PREFETCH_WORKERS) as prefetcher:
+        chosen = choose_course(course_ids)
+        session = prefetcher.session(chosen)
+    report = GradeReport(session.get_submissions())
+    summarize_points(report)
+    summarize_groups(report)
+    plot_scores(report)
+    plot_grade_trends(report)
 
 
 # 2) print_user_info
@@ -118,17 +126,9 @@ def summarize_points(submissions: [dict]):
     points obtained (sum of the submissions' score multiplied by the assignment's group_weight),
     and current grade for a class (points obtained divided by points possible so far)
     :Args:
-        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions
+        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions, or a GradeReport
     '''
-    points_obtained = 0
-    points_possible_so_far = 0
-    for submission in submissions:
-        if submission["score"] is not None:
-            score = submission["score"] * submission["assignment"]["group"]["group_weight"]
-            points_obtained = score + points_obtained
-            points = submission["assignment"]["points_possible"] * submission["assignment"]["group"]["group_weight"]
-            points_possible_so_far = points + points_possible_so_far
-            current_grade = round(100 * (points_obtained / points_possible_so_far))
+    points_possible_so_far, points_obtained, current_grade = compute_points(submissions)
     print("Points possible so far: " + str(points_possible_so_far))
     print("Points obtained: " + str(points_obtained))
     print("Current grade: " + str(current_grade))
@@ -141,44 +141,30 @@ def summarize_groups(submissions: [dict]):
     The unweighted grade is the total score for the group's submissions divided by the total points_possible for
     the group's submissions, multiplied by 100 and rounded.
     :Args:
-        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions
+        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions, or a GradeReport
     '''
-    groups = {}
-    points_possible = {}
-    for submission in submissions:
-        if submission["score"] is not None:
-            name = submission["assignment"]["group"]["name"]
-            if name not in groups:
-                groups[name] = 0
-                points_possible[name] = 0
-            groups[name] = groups[name] + submission["score"]
-            points_possible[name] = submission["assignment"]["points_possible"] + points_possible[name]
-    for name in groups:
-        key, value = groups[name], points_possible[name]
-        print("*", name, ":", round(100*(key/value)))
+    for name, grade in compute_groups(submissions).items():
+        print("*", name, ":", grade)
 
 
 # 9) plot_scores
-def plot_scores(submissions: [dict]):
+def plot_scores(submissions: [dict], filename: str = None):
     '''
     This function consumes a list of Submission dictionaries and plots each submissions' grade as a histogram
     :Args:
-        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions
+        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions, or a GradeReport
+        filename (str): File to save the plot to (e.g. "scores.png" or "scores.svg") instead of showing it
     '''
-    a = []
-    for submission in submissions:
-        if submission["score"] is not None and submission["assignment"]["points_possible"] > 0:
-            grade = (100*submission["score"])/(submission["assignment"]["points_possible"])
-            a.append(grade)
-    plt.hist(a)
+    plt = get_pyplot(filename)
+    plt.hist(get_report(submissions).percentages)
     plt.title("Distribution of Grades")
     plt.xlabel("Grades")
     plt.ylabel("Number of Assignments")
-    plt.show()
+    show_or_save(plt, filename)
 
 
 # 10) plot_grade_trends
-def plot_grade_trends(submissions: [dict]):
+def plot_grade_trends(submissions: [dict], filename: str = None):
     '''
     This function consumes a list of Submission dictionaries and plots the grade trend of the submissions as a line plot
     It plots the running sum of graded submission scores followed by the running sum of points still possible from
@@ -186,57 +172,641 @@ def plot_grade_trends(submissions: [dict]):
     0 on all ungraded assignments (Lowest), and the running sum of the points possible on all assignments in the course
     (Maximum).
     :Args:
-        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions
+        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions, or a GradeReport
+        filename (str): File to save the plot to (e.g. "trends.png" or "trends.svg") instead of showing it
     '''
-    running_high_sum = 0
-    running_high_sums = []
-    running_low_sum = 0
-    running_low_sums = []
-    maximum = 0
-    maximums = []
-    dates = []
-    total_points = 0
-    for submission in submissions:
-        total_points = submission["assignment"]["points_possible"] * submission["assignment"]["group"]["group_weight"] + total_points
-        a_string_date = submission["assignment"]["due_at"]
-        dates.append(datetime.datetime.strptime(a_string_date, "%Y-%m-%dT%H:%M:%SZ"))
-        maximum = 100 * submission["assignment"]["points_possible"] * submission["assignment"]["group"]["group_weight"] + maximum
-        maximums.append(maximum)
-        if submission["score"] is None:
-            running_high_sum = 100 * submission["assignment"]["points_possible"] * submission["assignment"]["group"]["group_weight"] + running_high_sum
-            running_high_sums.append(running_high_sum)
-            running_low_sum = running_low_sum + 0
-            running_low_sums.append(running_low_sum)
-        else:
-            running_high_sum = 100 * submission["score"] * submission["assignment"]["group"]["group_weight"] + running_high_sum
-            running_high_sums.append(running_high_sum)
-            running_low_sum = 100 * submission["score"] * submission["assignment"]["group"]["group_weight"] + running_low_sum
-            running_low_sums.append(running_low_sum)
-    final_high_sums = []
-    for hnum in running_high_sums:
-        finalh = hnum/total_points
-        final_high_sums.append(finalh)
-    final_low_sums = []
-    for lnum in running_low_sums:
-        finall = lnum/total_points
-        final_low_sums.append(finall)
-    final_max = []
-    for mnum in maximums:
-        finalm = mnum/total_points
-        final_max.append(finalm)
+    plt = get_pyplot(filename)
+    dates, final_high_sums, final_low_sums, final_max = get_report(submissions).trends()
     plt.plot(dates, final_high_sums, label="Highest")
     plt.plot(dates, final_low_sums, label="Lowest")
     plt.plot(dates, final_max, label="Maximum")
     plt.legend()
     plt.title("Grade Trend")
     plt.ylabel("Grade")
-    plt.show()
+    show_or_save(plt, filename)
+
+
+# 11) compute_points
+def compute_points(submissions: [dict]) -> (float, float, int):
+    '''
+    This function consumes a list of submission dictionaries and returns the weighted points possible so far, the
+    weighted points obtained, and the current grade, as printed by summarize_points.
+    :Args:
+        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions, or a GradeReport
+    :return:
+        (float, float, int): Points possible so far, points obtained, and current grade (None if nothing is graded)
+    '''
+    report = get_report(submissions)
+    return report.points_possible_so_far, report.points_obtained, report.current_grade
+
+
+# 12) compute_groups
+def compute_groups(submissions: [dict]) -> dict:
+    '''
+    This function consumes a list of Submission dictionaries and returns a dictionary mapping each group name to its
+    unweighted grade, as printed by summarize_groups.
+    :Args:
+        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions, or a GradeReport
+    :return:
+        dict: Group names mapped to their unweighted grades, in the order the groups first appear
+    '''
+    return get_report(submissions).group_grades()
+
+
+# 13) analyze_course
+def analyze_course(user_id: str, course_id: int, plot_files: [str] = None, stream: bool = False) -> dict:
+    '''
+    This function consumes a user token and a course ID and returns that user's summary for the course without
+    printing or prompting. Errors from Canvas are recorded in the summary instead of raised.
+    If plot_files is given, the score and grade trend plots are saved to those two files.
+    Streaming decodes one submission at a time, but goes straight to the cache file or Canvas, skipping the memory
+    cache, request coalescing and the write-through cache, so it is only worth it for very large courses.
+    :Args:
+        user_id (str): User token
+        course_id (int): Course ID
+        plot_files ([str]): Files to save the score and grade trend plots to, or None for no plots
+        stream (bool): Stream the submissions with iter_submissions instead of loading them with get_submissions
+    :return:
+        dict: The user's printable label, course, points possible so far, points obtained, current grade, group
+        grades, and plot files
+    '''
+    # Tokens are secrets, so summaries only hold a label that is safe to print
+    summary = {"user": canvas_requests.describe_user(user_id), "course": course_id}
+    try:
+        if stream:
+            report = GradeReport(canvas_requests.iter_submissions(user_id, course_id))
+        else:
+            report = GradeReport(canvas_requests.get_submissions(user_id, course_id))
+    except canvas_requests.CanvasException as error:
+        summary["error"] = str(error)
+        return summary
+    summary["points_possible"] = report.points_possible_so_far
+    summary["points_obtained"] = report.points_obtained
+    summary["grade"] = report.current_grade
+    summary["groups"] = report.group_grades()
+    if plot_files is not None:
+        summary["plots"] = list(plot_files)
+        plot_scores(report, summary["plots"][0])
+        plot_grade_trends(report, summary["plots"][1])
+    return summary
+
+
+# 14) get_available_course_ids
+def get_available_course_ids(user_id: str) -> [int]:
+    '''
+    This function consumes a user token and returns the IDs of the user's available courses.
+    :Args:
+        user_id (str): User token
+    :return:
+        [int]: List of integers representing available course IDs
+    '''
+    return get_course_ids(filter_available_courses(canvas_requests.get_courses(user_id)))
+
+
+def _get_available_course_ids_or_error(user_id: str) -> ([int], str):
+    '''
+    Like get_available_course_ids, but an error from Canvas (e.g., a revoked token) is returned instead of raised,
+    so one user cannot stop a whole batch.
+    :return:
+        ([int], str): The available course IDs, and the error message or None
+    '''
+    try:
+        return get_available_course_ids(user_id), None
+    except canvas_requests.CanvasException as error:
+        return [], str(error)
+
+
+# 15) batch_main
+def batch_main(user_ids: [str], course_ids: [int] = None, workers: int = 8, processes: bool = False,
+               plot_directory: str = None) -> str:
+    '''
+    This function consumes a list of user tokens and analyzes their courses non-interactively on a worker pool,
+    returning one consolidated report. Each user's available courses are analyzed, limited to course_ids if given.
+    A user whose courses cannot be listed gets an error entry in the report instead of stopping the batch.
+    If plot_directory is given, each course's plots are rendered headlessly into it.
+    :Args:
+        user_ids ([str]): List of user tokens
+        course_ids ([int]): Course IDs to analyze, or None for every available course
+        workers (int): Number of workers in the pool
+        processes (bool): Use a process pool instead of a thread pool
+        plot_directory (str): Directory to save plots in, or None for no plots
+    :return:
+        str: The consolidated report, one section per user and course
+    '''
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    # Saved plots are drawn on figures of their own, so threads need no setup. Worker processes may start from a
+    # fresh interpreter (e.g. the spawn start method), so they are switched to headless mode themselves and are
+    # given whole filenames rather than reading PLOT_FORMAT
+    pool_options = {}
+    if processes and plot_directory is not None:
+        pool_options = {"initializer": configure_plots, "initargs": (True,)}
+    with pool_class(max_workers=workers, **pool_options) as pool:
+        available = pool.map(_get_available_course_ids_or_error, user_ids)
+        jobs = []
+        # Each user's entry is either an error summary or how many jobs they have
+        entries = []
+        for user_id, (user_course_ids, error) in zip(user_ids, available):
+            if error is not None:
+                entries.append({"user": canvas_requests.describe_user(user_id), "course": None, "error": error})
+                continue
+            user_jobs = [(user_id, course_id) for course_id in user_course_ids
+                         if course_ids is None or course_id in course_ids]
+            jobs.extend(user_jobs)
+            entries.append(len(user_jobs))
+        plot_files = [None] * len(jobs)
+        if plot_directory is not None:
+            os.makedirs(plot_directory, exist_ok=True)
+            # Tokens are secrets, so files are named by job number instead
+            plot_files = [[os.path.join(plot_directory, "{:04d}_{}_{}.{}".format(index, course_id, kind, PLOT_FORMAT))
+                           for kind in ("scores", "trends")]
+                          for index, (user_id, course_id) in enumerate(jobs)]
+        summaries = iter(pool.map(analyze_course, *zip(*jobs), plot_files) if jobs else [])
+        report = []
+        for entry in entries:
+            if isinstance(entry, dict):
+                report.append(entry)
+            else:
+                report.extend(next(summaries) for _ in range(entry))
+        return format_report(report)
+
+
+# 16) format_report
+def format_report(summaries: [dict]) -> str:
+    '''
+    This function consumes a list of course summaries from analyze_course and returns them as a printable report.
+    :Args:
+        summaries ([dict]): List of summary dictionaries from analyze_course
+    :return:
+        str: The report text
+    '''
+    lines = []
+    for summary in summaries:
+        if summary["course"] is None:
+            lines.append("User: " + str(summary["user"]))
+        else:
+            lines.append("User: " + str(summary["user"]) + ", Course: " + str(summary["course"]))
+        if "error" in summary:
+            lines.append("Error: " + summary["error"])
+            continue
+        lines.append("Points possible so far: " + str(summary["points_possible"]))
+        lines.append("Points obtained: " + str(summary["points_obtained"]))
+        lines.append("Current grade: " + str(summary["grade"]))
+        for name, grade in summary["groups"].items():
+            lines.append("* " + name + " : " + str(grade))
+        for filename in summary.get("plots", []):
+            lines.append("Plot: " + filename)
+    return "\n".join(lines)
+
+
+# Plots are shown on screen, unless headless mode is on (see configure_plots)
+HEADLESS = False
+PLOT_FORMAT = "png"
+
+
+# 17) configure_plots
+def configure_plots(headless: bool = None, plot_format: str = None):
+    '''
+    This function changes how plots are rendered. In headless mode matplotlib uses the Agg backend, which needs no
+    display, so plots can only be saved to files.
+    :Args:
+        headless (bool): Whether to render without a display
+        plot_format (str): File extension used for batch plots, such as "png" or "svg"
+    '''
+    global HEADLESS, PLOT_FORMAT
+    if headless is not None:
+        HEADLESS = headless
+    if plot_format is not None:
+        PLOT_FORMAT = plot_format
+
+
+# 18) get_pyplot
+def get_pyplot(filename: str = None):
+    '''
+    This function imports and returns matplotlib.pyplot. It is imported on first use, so that text-only runs never
+    pay for importing matplotlib. A plot that will be saved to a file is drawn on a figure of its own instead, which
+    needs no display and shares nothing with pyplot, so any thread can save plots without switching to headless mode.
+    :Args:
+        filename (str): File the plot will be saved to, or None if it will be shown
+    :return:
+        module: The matplotlib.pyplot module, or a _FigurePlot with the same plotting functions
+    '''
+    if filename is not None:
+        return _FigurePlot()
+    if HEADLESS:
+        import matplotlib
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+class _FigurePlot:
+    '''
+    The pyplot functions that the plots use, drawing on a matplotlib Figure of their own rather than on pyplot's
+    current figure.
+    '''
+    def __init__(self):
+        from matplotlib.figure import Figure
+        self.figure = Figure()
+        axes = self.figure.add_subplot()
+        self.hist, self.plot, self.legend = axes.hist, axes.plot, axes.legend
+        self.title, self.xlabel, self.ylabel = axes.set_title, axes.set_xlabel, axes.set_ylabel
+        self.savefig = self.figure.savefig
+
+    def close(self):
+        # Nothing else refers to the figure, so it is freed with this object
+        pass
+
+
+# 19) show_or_save
+def show_or_save(plt, filename: str = None):
+    '''
+    This function shows the current plot, or saves it to filename and closes it so figures do not pile up.
+    :Args:
+        plt (module): The matplotlib.pyplot module, or the _FigurePlot from get_pyplot(filename)
+        filename (str): File to save the plot to, or None to show it
+    '''
+    if filename is None:
+        plt.show()
+    else:
+        plt.savefig(filename)
+        plt.close()
+
+
+# 20) GradeReport
+class GradeReport:
+    '''
+    This class consumes an iterable of Submission dictionaries exactly once and accumulates everything the summaries
+    and plots need: the weighted points, the per-group totals, the per-assignment percentages, and the running grade
+    trend sums. Each submission's fields are read once, however many reports are produced from it.
+    :Args:
+        submissions ([dict]): Iterable of submission dictionaries from canvas_requests.get_submissions
+    '''
+    def __init__(self, submissions: [dict] = ()):
+        self.points_possible_so_far = 0
+        self.points_obtained = 0
+        self.graded = 0
+        self.group_scores = {}
+        self.group_points_possible = {}
+        self.group_counts = {}
+        self.percentages = []
+        self.dates = []
+        self.steps = []
+        self.total_points = 0
+        self.positions = {}
+        self._trends = None
+        for submission in submissions:
+            self.add(submission)
+
+    def add(self, submission: dict):
+        '''
+        This method adds one submission to every running total.
+        :Args:
+            submission (dict): Submission dictionary from canvas_requests.get_submissions
+        '''
+        assignment = submission["assignment"]
+        self.positions[assignment["id"]] = len(self.dates)
+        self._count(submission, assignment)
+        self.dates.append(parse_due_date(assignment["due_at"]))
+        self.steps.append(self._steps(submission, assignment))
+        self._trends = None
+
+    def update(self, old: dict, new: dict):
+        '''
+        This method replaces a submission that was already added with a newer version of it (such as after grading),
+        without walking the other submissions again. The points and groups are updated directly, and only the
+        submission's own trend step is replaced; the trend sums are redone the next time trends is called. If old is
+        None, the new submission is simply added.
+        :Args:
+            old (dict): The submission as it was added, or None for a new submission
+            new (dict): The new version of the submission
+        '''
+        if old is None:
+            self.add(new)
+            return
+        old_assignment, new_assignment = old["assignment"], new["assignment"]
+        index = self.positions.pop(old_assignment["id"])
+        self.positions[new_assignment["id"]] = index
+        self._count(old, old_assignment, removing=True)
+        self._count(new, new_assignment)
+        self.dates[index] = parse_due_date(new_assignment["due_at"])
+        self.steps[index] = self._steps(new, new_assignment)
+        self._trends = None
+
+    def apply(self, changes: [(dict, dict)]):
+        '''
+        This method applies every (old, new) pair from canvas_requests.sync_submissions with update.
+        :Args:
+            changes ([(dict, dict)]): List of (old, new) submission pairs
+        '''
+        for old, new in changes:
+            self.update(old, new)
+
+    def _count(self, submission: dict, assignment: dict, removing: bool = False):
+        '''
+        This method adds a submission's points to the totals, or takes them back out when removing.
+        '''
+        score = submission["score"]
+        points_possible = assignment["points_possible"]
+        group = assignment["group"]
+        group_weight = group["group_weight"]
+        weighted_possible = points_possible * group_weight
+        if removing:
+            self.total_points = self.total_points - weighted_possible
+        else:
+            self.total_points = weighted_possible + self.total_points
+        if score is None:
+            return
+        name = group["name"]
+        if removing:
+            self.graded = self.graded - 1
+            self.points_obtained = self.points_obtained - score * group_weight
+            self.points_possible_so_far = self.points_possible_so_far - weighted_possible
+            self.group_scores[name] = self.group_scores[name] - score
+            self.group_points_possible[name] = self.group_points_possible[name] - points_possible
+            self.group_counts[name] = self.group_counts[name] - 1
+            if points_possible > 0:
+                self.percentages.remove((100*score)/points_possible)
+            return
+        self.graded = self.graded + 1
+        self.points_obtained = score * group_weight + self.points_obtained
+        self.points_possible_so_far = weighted_possible + self.points_possible_so_far
+        if name not in self.group_scores:
+            self.group_scores[name] = 0
+            self.group_points_possible[name] = 0
+            self.group_counts[name] = 0
+        self.group_scores[name] = self.group_scores[name] + score
+        self.group_points_possible[name] = points_possible + self.group_points_possible[name]
+        self.group_counts[name] = self.group_counts[name] + 1
+        if points_possible > 0:
+            self.percentages.append((100*score)/points_possible)
+
+    def _steps(self, submission: dict, assignment: dict) -> (float, float, float):
+        '''
+        This method returns how much a submission adds to the Maximum, Highest, and Lowest running sums.
+        '''
+        score = submission["score"]
+        group_weight = assignment["group"]["group_weight"]
+        weighted_possible = 100 * assignment["points_possible"] * group_weight
+        if score is None:
+            return weighted_possible, weighted_possible, 0
+        return weighted_possible, 100 * score * group_weight, 100 * score * group_weight
+
+    @property
+    def current_grade(self) -> int:
+        '''
+        :return:
+            int: Points obtained divided by points possible so far, multiplied by 100 and rounded (None if nothing
+            is graded)
+        '''
+        if not self.graded:
+            return None
+        return round(100 * (self.points_obtained / self.points_possible_so_far))
+
+    def group_grades(self) -> dict:
+        '''
+        :return:
+            dict: Group names mapped to their unweighted grades, in the order the groups first appear
+        '''
+        grades = {}
+        for name in self.group_scores:
+            if not self.group_counts[name]:
+                continue
+            key, value = self.group_scores[name], self.group_points_possible[name]
+            grades[name] = round(100*(key/value))
+        return grades
+
+    def trends(self) -> ((datetime.datetime, ...), (float, ...), (float, ...), (float, ...)):
+        '''
+        The submissions are put in due date order once (see order_timeline) and the result is kept until the report
+        changes. The series are tuples, so they can be handed out without being copied.
+        :return:
+            tuple: The due dates and the Highest, Lowest, and Maximum grade trend lines
+        '''
+        if self._trends is None:
+            order, dates = order_timeline(self.dates)
+            total_points = self.total_points
+            maximum = high = low = 0
+            highs, lows, maxes = [], [], []
+            for index in order:
+                step_maximum, step_high, step_low = self.steps[index]
+                maximum = step_maximum + maximum
+                high = step_high + high
+                low = step_low + low
+                highs.append(high/total_points)
+                lows.append(low/total_points)
+                maxes.append(maximum/total_points)
+            self._trends = (tuple(dates), tuple(highs), tuple(lows), tuple(maxes))
+        return self._trends
+
+
+# 21) get_report
+def get_report(submissions) -> GradeReport:
+    '''
+    This function consumes a list of Submission dictionaries, or a GradeReport that was already built from them, and
+    returns the GradeReport, so that passing a report around avoids walking the submissions again.
+    :Args:
+        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions, or a GradeReport
+    :return:
+        GradeReport: The report for those submissions
+    '''
+    if isinstance(submissions, GradeReport):
+        return submissions
+    return GradeReport(submissions)
+
+
+# 22) sync_report
+def sync_report(user_id: str, course_id: int, report: GradeReport = None) -> GradeReport:
+    '''
+    This function consumes a user token, a course ID, and optionally the GradeReport from an earlier sync, brings the
+    course's cached submissions up to date with canvas_requests.sync_submissions, and returns an up to date report.
+    An earlier report is updated with just the changed submissions instead of being rebuilt, unless the whole course
+    had to be downloaded again (e.g. after canvas_requests.clear_live_cache), when a new report is built.
+    :Args:
+        user_id (str): User token
+        course_id (int): Course ID
+        report (GradeReport): The report from the previous sync, or None to build a new one
+    :return:
+        GradeReport: The report for the course's current submissions, which is a new one if it was rebuilt
+    '''
+    submissions, changes = canvas_requests.sync_submissions(user_id, course_id)
+    if report is None or changes is None:
+        return GradeReport(submissions)
+    report.apply(changes)
+    return report
+
+
+# 23) parse_due_date
+@functools.lru_cache(maxsize=4096)
+def parse_due_date(due_at: str) -> datetime.datetime:
+    '''
+    This function consumes a Canvas due date (e.g. "2017-08-30T16:20:00Z") and returns it as a datetime. Canvas dates
+    are ISO 8601, so they are read with datetime.fromisoformat rather than the much slower strptime, and each distinct
+    date is only parsed once, since many assignments share a due date.
+    :Args:
+        due_at (str): The assignment's due_at, or None if it has no due date
+    :return:
+        datetime.datetime: The due date, or None if there is none
+    '''
+    if due_at is None:
+        return None
+    if due_at.endswith("Z"):
+        due_at = due_at[:-1]
+    return datetime.datetime.fromisoformat(due_at)
+
+
+# 24) order_timeline
+def order_timeline(dates: [datetime.datetime]) -> ([int], [datetime.datetime]):
+    '''
+    This function consumes the due dates of some submissions and sorts them once, returning the order in which to walk
+    the submissions along with their dates in that order. Submissions due at the same time keep their original order.
+    Undated submissions come last and are placed at the latest due date, so that they can still be plotted.
+    :Args:
+        dates ([datetime.datetime]): Due dates from parse_due_date, with None for undated submissions
+    :return:
+        ([int], [datetime.datetime]): Indexes into dates in due date order, and the dates in that order
+    '''
+    order = sorted(range(len(dates)), key=lambda index: (dates[index] is None, dates[index] or datetime.datetime.min))
+    ordered = [dates[index] for index in order]
+    latest = None
+    for position, date in enumerate(ordered):
+        if date is None:
+            ordered[position] = latest
+        else:
+            latest = date
+    return order, ordered
+
+
+# 25) build_timeline
+def build_timeline(submissions: [dict]) -> [(datetime.datetime, dict)]:
+    '''
+    This function consumes a list of Submission dictionaries and returns them in due date order, each paired with its
+    parsed due date, for any report that walks the submissions by date.
+    :Args:
+        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions
+    :return:
+        [(datetime.datetime, dict)]: (due date, submission) pairs, sorted by due date as in order_timeline
+    '''
+    submissions = list(submissions)
+    order, dates = order_timeline([parse_due_date(submission["assignment"]["due_at"]) for submission in submissions])
+    return [(date, submissions[index]) for index, date in zip(order, dates)]
+
+
+# 26) compute_trends
+def compute_trends(submissions: [dict]) -> dict:
+    '''
+    This function consumes a list of Submission dictionaries and returns the series that plot_grade_trends draws, as
+    sequences that json.dumps can write directly, without importing matplotlib. The lines are the GradeReport's own
+    cached tuples, which cannot be changed, so asking the same report again only formats the dates.
+    :Args:
+        submissions ([dict]): List of submission dictionaries from canvas_requests.get_submissions, or a GradeReport
+    :return:
+        dict: "dates" (ISO 8601 due dates, in due date order), and the "highest", "lowest", and "maximum" lines
+    '''
+    dates, highs, lows, maxes = get_report(submissions).trends()
+    formatted = {}
+    for date in dates:
+        if date not in formatted:
+            formatted[date] = None if date is None else date.isoformat() + "Z"
+    return {"dates": [formatted[date] for date in dates], "highest": highs, "lowest": lows, "maximum": maxes}
+
+
+# main prefetches no courses, unless configured to (see configure_prefetch)
+PREFETCH_COURSES = 0
+PREFETCH_WORKERS = 2
+
+
+# 27) configure_prefetch
+def configure_prefetch(courses: int = None, workers: int = None):
+    '''
+    This function sets how many of the listed courses main starts fetching in the background while choose_course
+    waits for input, and how many of them are fetched at once. The courses that are not chosen are cancelled if they
+    have not started yet.
+    :Args:
+        courses (int): Most courses to prefetch, in the order they are listed (0 turns prefetching off)
+        workers (int): Most courses to fetch at once
+    '''
+    global PREFETCH_COURSES, PREFETCH_WORKERS
+    if courses is not None:
+        PREFETCH_COURSES = courses
+    if workers is not None:
+        PREFETCH_WORKERS = workers
+
+
+# 28) iter_course_summaries
+def iter_course_summaries(user_id: str, course_ids: [int] = None, workers: int = 8):
+    '''
+    This function consumes a user token and analyzes all of the user's available courses at the same time on a
+    thread pool, yielding each course's summary from analyze_course as soon as that course finishes, so the fastest
+    courses come out first.
+    :Args:
+        user_id (str): User token
+        course_ids ([int]): Course IDs to analyze, or None for every available course
+        workers (int): Most courses to analyze at once
+    :return:
+        generator: The summary dictionary of each course, in the order they finish
+    '''
+    if course_ids is None:
+        course_ids = get_available_course_ids(user_id)
+    if not course_ids:
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(analyze_course, user_id, course_id) for course_id in course_ids]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+# 29) format_overview
+def format_overview(summaries: [dict]) -> str:
+    '''
+    This function consumes the course summaries of one user and returns a cross-course overview: how many courses
+    were analyzed, the average current grade, and the courses with the highest and lowest grades.
+    :Args:
+        summaries ([dict]): List of summary dictionaries from analyze_course
+    :return:
+        str: The overview text
+    '''
+    graded = [summary for summary in summaries if summary.get("grade") is not None]
+    errors = [summary for summary in summaries if "error" in summary]
+    lines = ["Courses analyzed: " + str(len(summaries)) + ", with errors: " + str(len(errors))]
+    if graded:
+        highest = max(graded, key=lambda summary: summary["grade"])
+        lowest = min(graded, key=lambda summary: summary["grade"])
+        average = sum(summary["grade"] for summary in graded) / len(graded)
+        lines.append("Average grade: " + str(round(average)))
+        lines.append("Highest grade: " + str(highest["grade"]) + " in course " + str(highest["course"]))
+        lines.append("Lowest grade: " + str(lowest["grade"]) + " in course " + str(lowest["course"]))
+    return "\n".join(lines)
+
+
+# 30) summarize_all_courses
+def summarize_all_courses(user_id: str, workers: int = 8) -> [dict]:
+    '''
+    This function consumes a user token and prints the summary of every available course, each as soon as it is
+    ready, followed by the cross-course overview.
+    :Args:
+        user_id (str): User token
+        workers (int): Most courses to analyze at once
+    :return:
+        [dict]: The summary dictionaries, in the order they were printed
+    '''
+    summaries = []
+    for summary in iter_course_summaries(user_id, workers=workers):
+        print(format_report([summary]), flush=True)
+        summaries.append(summary)
+    print(format_overview(summaries))
+    return summaries
 
 
 # Keep any function tests inside this IF statement to ensure
 # that your `test_my_solution.py` does not execute it.
 # main('25~t8y3fQkkX86KigbVz83gCo1U5mVgodUBNwJo4TSSkritxzKsfATqcs6SH2ceHuMd')
 if __name__ == "__main__":
-    main('hermione')
-    main('ron')
-    main('harry')
+    if len(sys.argv) > 2 and sys.argv[1] == "--all-courses":
+        for user in sys.argv[2:]:
+            summarize_all_courses(user)
+    elif len(sys.argv) > 1:
+        print(batch_main(sys.argv[1:]))
+    else:
+        main('hermione')
+        main('ron')
+        main('harry')
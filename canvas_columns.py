@@ -0,0 +1,177 @@
+"""
+Columnar NumPy backend for the grade computations in `canvas_analyzer.py`.
+
+The submissions of a course are turned into one NumPy array per field, once,
+and every statistic is then computed with whole-array operations instead of
+walking the nested submission dictionaries. Results match `GradeReport`.
+
+NumPy is optional; `canvas_analyzer` never needs this module.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import canvas_requests
+
+
+class SubmissionColumns:
+    '''
+    The fields of a list of submissions, stored as parallel NumPy arrays.
+
+    Params:
+        submissions (list): Submission dictionaries from
+                            canvas_requests.get_submissions
+    Attributes:
+        score (numpy.ndarray): Scores, with NaN for ungraded submissions
+        points_possible (numpy.ndarray): Each assignment's points possible
+        group_weight (numpy.ndarray): Each assignment's group weight
+        group_id (numpy.ndarray): Index into `group_names` for each assignment
+        due_at (numpy.ndarray): Due dates as datetime64, with NaT if missing
+        group_names (list): Group names, in the order they first appear
+    '''
+    def __init__(self, submissions):
+        if numpy is None:
+            raise ImportError("The columnar backend needs NumPy installed.")
+        submissions = list(submissions)
+        count = len(submissions)
+        self.score = numpy.empty(count)
+        self.points_possible = numpy.empty(count)
+        self.group_weight = numpy.empty(count)
+        self.group_id = numpy.empty(count, dtype=numpy.intp)
+        self.due_at = numpy.empty(count, dtype='datetime64[s]')
+        self.group_names = []
+        group_ids = {}
+        for index, submission in enumerate(submissions):
+            assignment = submission["assignment"]
+            group = assignment["group"]
+            score = submission["score"]
+            self.score[index] = numpy.nan if score is None else score
+            self.points_possible[index] = assignment["points_possible"]
+            self.group_weight[index] = group["group_weight"]
+            name = group["name"]
+            if name not in group_ids:
+                group_ids[name] = len(self.group_names)
+                self.group_names.append(name)
+            self.group_id[index] = group_ids[name]
+            due_at = assignment["due_at"]
+            self.due_at[index] = 'NaT' if due_at is None else due_at.rstrip('Z')
+        self.graded = ~numpy.isnan(self.score)
+
+    def __len__(self):
+        return len(self.score)
+
+
+def _running_total(values):
+    # cumsum adds left to right, exactly like the loops it replaces
+    # (numpy.sum adds pairwise, which can differ in the last digit)
+    return numpy.cumsum(values)[-1] if len(values) else 0.0
+
+
+def weighted_grade(columns):
+    '''
+    Vectorized `canvas_analyzer.compute_points`.
+
+    Params:
+        columns (SubmissionColumns): The course's submissions
+    Returns:
+        tuple: Points possible so far, points obtained, and current grade
+               (None if nothing is graded)
+    '''
+    graded = columns.graded
+    weights = columns.group_weight[graded]
+    obtained = _running_total(columns.score[graded] * weights)
+    possible = _running_total(columns.points_possible[graded] * weights)
+    if not graded.any():
+        return possible, obtained, None
+    return possible, obtained, round(100 * (obtained / possible))
+
+
+def group_grades(columns):
+    '''
+    Vectorized `canvas_analyzer.compute_groups`.
+
+    Params:
+        columns (SubmissionColumns): The course's submissions
+    Returns:
+        dict: Group names mapped to their unweighted grades, in the order the
+              groups first appear
+    '''
+    graded = columns.graded
+    group_id = columns.group_id[graded]
+    groups = len(columns.group_names)
+    scores = numpy.bincount(group_id, columns.score[graded], groups)
+    possible = numpy.bincount(group_id, columns.points_possible[graded], groups)
+    has_graded = numpy.bincount(group_id, minlength=groups) > 0
+    return {columns.group_names[index]: round(100*(scores[index]/possible[index]))
+            for index in numpy.flatnonzero(has_graded)}
+
+
+def score_percentages(columns):
+    '''
+    The grades that `canvas_analyzer.plot_scores` draws.
+
+    Params:
+        columns (SubmissionColumns): The course's submissions
+    Returns:
+        numpy.ndarray: 100 * score / points possible for each graded
+                       submission worth more than 0 points
+    '''
+    plotted = columns.graded & (columns.points_possible > 0)
+    return (100*columns.score[plotted])/columns.points_possible[plotted]
+
+
+def score_histogram(columns, bins=10):
+    '''
+    Bins the grades the way `plt.hist` does by default.
+
+    Params:
+        columns (SubmissionColumns): The course's submissions
+        bins (int): How many equal-width bins to use
+    Returns:
+        tuple: The count in each bin and the bin edges
+    '''
+    return numpy.histogram(score_percentages(columns), bins=bins)
+
+
+def grade_trends(columns):
+    '''
+    Vectorized running sums of `canvas_analyzer.plot_grade_trends`, taken in
+    due date order like `canvas_analyzer.order_timeline`.
+
+    Params:
+        columns (SubmissionColumns): The course's submissions
+    Returns:
+        tuple: The due dates and the Highest, Lowest, and Maximum grade trend
+               lines, as arrays
+    '''
+    total_points = _running_total(columns.points_possible * columns.group_weight)
+    # A stable sort puts NaT last; undated submissions go at the latest date
+    order = numpy.argsort(columns.due_at, kind='stable')
+    due_at = columns.due_at[order]
+    undated = numpy.isnat(due_at)
+    if undated.any() and not undated.all():
+        due_at[undated] = due_at[~undated][-1]
+    graded = columns.graded[order]
+    group_weight = columns.group_weight[order]
+    weighted_possible = 100 * columns.points_possible[order] * group_weight
+    weighted_score = 100 * numpy.where(graded, columns.score[order], 0) * group_weight
+    maximums = numpy.cumsum(weighted_possible)
+    highs = numpy.cumsum(numpy.where(graded, weighted_score, weighted_possible))
+    lows = numpy.cumsum(weighted_score)
+    return (due_at, highs / total_points, lows / total_points,
+            maximums / total_points)
+
+
+def build_columns(user_id, course_id):
+    '''
+    Fetches a course's submissions and turns them into columns.
+
+    Params:
+        user_id (str): The User (e.g., 'hermione') or API token
+        course_id (int): The course to fetch
+    Returns:
+        SubmissionColumns: The course's submissions as columns
+    '''
+    session = canvas_requests.CourseSession(user_id, course_id)
+    return SubmissionColumns(session.get_submissions())
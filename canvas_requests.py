@@ -10,11 +10,21 @@ own local version anyway.
 """
 __version__ = 7
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import json
 import sqlite3
 import sys 
 import re
+import threading
+import asyncio
+import time
+import hashlib
+import atexit
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qs, urlencode
 
 def get_user(user_id):
     return get("users/self/profile", user_id)
@@ -23,14 +33,514 @@ def get_courses(user_id):
     return get("courses", user_id)
 
 def get_submissions(user_id, course_id):
-    submissions = get("courses/{}/students/submissions".format(course_id), user_id)
-    groups = get("courses/{}/assignment_groups".format(course_id), user_id)
-    group_map = {g['id']: g for g in groups}
+    submissions = get(_submissions_url(course_id), user_id)
+    group_map = GROUP_INDEX.get(user_id, course_id)
+    return _attach_group_map(submissions, group_map)
+
+def _submissions_url(course_id):
+    return "courses/{}/students/submissions".format(course_id)
+
+def _groups_url(course_id):
+    return "courses/{}/assignment_groups".format(course_id)
+
+def _attach_groups(submissions, groups):
+    return _attach_group_map(submissions, {g['id']: g for g in groups})
+
+def _attach_group_map(submissions, group_map):
     for submission in submissions:
         assignment_group_id = submission['assignment']['assignment_group_id']
         submission['assignment']['group'] = group_map[assignment_group_id].copy()
     return submissions
 
+def get_submission_records(user_id, course_id):
+    '''
+    Compact version of `get_submissions`. Each submission is a `Submission`
+    record instead of nested dictionaries, and every assignment of a group
+    shares one `Group` record instead of holding its own copy. Records can
+    still be read like dictionaries (e.g., `submission["assignment"]`).
+    
+    Params:
+        user_id (str): The User (e.g., 'hermione') or API token
+        course_id (int): The ID of the course
+    Returns:
+        list: A `Submission` record for each submission in the course
+    '''
+    submissions = get(_submissions_url(course_id), user_id)
+    groups = GROUP_INDEX.get(user_id, course_id).values()
+    return _build_records(submissions, groups)
+
+def _build_records(submissions, groups):
+    group_map = {g['id']: Group.from_dict(g) for g in groups}
+    return [Submission.from_dict(submission, group_map)
+            for submission in submissions]
+
+class _Record:
+    '''
+    Base class for the compact records. The fields are stored in slots, and
+    can be read either as attributes or with dictionary-style lookups.
+    '''
+    __slots__ = ()
+    
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __contains__(self, key):
+        return key in self.__slots__
+    
+    def __iter__(self):
+        return iter(self.__slots__)
+    
+    def __len__(self):
+        return len(self.__slots__)
+    
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return all(self[key] == other[key] for key in self)
+    
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+            "{}={!r}".format(key, self[key]) for key in self))
+    
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+    
+    def keys(self):
+        return self.__slots__
+    
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+class GroupIndex:
+    '''
+    The assignment groups of each course, indexed by group ID. Group names
+    and weights are the same for every student in a course, so the groups
+    endpoint is fetched once per course and the index is shared by every
+    user and thread, instead of being fetched again for each student. Sample
+    courses and live courses are indexed separately. Sample courses are kept
+    for good; live courses are fetched again once they are older than
+    `CACHE_TTL`, like write-through responses.
+    
+    Callers must not change the groups they get; `get_submissions` attaches
+    copies of them.
+    
+    Attributes:
+        fetches (int): How many times a course's groups were fetched
+    '''
+    def __init__(self):
+        self.fetches = 0
+        self._courses = {}
+        self._course_locks = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+    
+    def get(self, user_id, course_id):
+        '''
+        Returns a course's groups, fetching them with the user's token only
+        if no one has yet. Threads asking for the same course at the same
+        time wait for a single fetch.
+        
+        Params:
+            user_id (str): The User (e.g., 'hermione') or API token
+            course_id (int): The ID of the course
+        Returns:
+            dict: Group IDs mapped to the group dictionaries
+        '''
+        key = (None if user_id.lower() in _get_users() else BASE_URL, course_id)
+        with self._lock:
+            group_map = self._lookup(key)
+            if group_map is not None:
+                return group_map
+            course_lock = self._course_locks.setdefault(key, threading.Lock())
+        with course_lock:
+            with self._lock:
+                group_map = self._lookup(key)
+                generation = self._generations.get(key, 0)
+            if group_map is None:
+                groups = get(_groups_url(course_id), user_id)
+                group_map = {g['id']: g for g in groups}
+                with self._lock:
+                    # Groups fetched before an invalidate may be out of date
+                    if self._generations.get(key, 0) == generation:
+                        self._courses[key] = (group_map, time.time())
+                    self.fetches += 1
+        return group_map
+    
+    def _lookup(self, key):
+        '''
+        Returns the indexed groups of a course, or None if they are not
+        indexed or have expired. Must be called holding `_lock`.
+        '''
+        entry = self._courses.get(key)
+        if entry is None:
+            return None
+        group_map, fetched_at = entry
+        if key[0] is not None and fetched_at < time.time() - CACHE_TTL:
+            return None
+        return group_map
+    
+    def invalidate(self, course_id=None):
+        '''
+        Forgets the groups of one course, or of every course, so that they
+        are fetched again (e.g., after an instructor changes the weights).
+        A fetch that is already running is not indexed when it finishes.
+        
+        Params:
+            course_id (int): The course to forget, or None for all of them
+        '''
+        with self._lock:
+            for key in self._course_locks:
+                if course_id is None or key[1] == course_id:
+                    self._courses.pop(key, None)
+                    self._generations[key] = self._generations.get(key, 0) + 1
+
+GROUP_INDEX = GroupIndex()
+
+class Group(_Record):
+    '''
+    An assignment group, shared by every assignment in it.
+    '''
+    __slots__ = ('id', 'name', 'group_weight')
+    
+    def __init__(self, id, name, group_weight):
+        self.id = id
+        self.name = sys.intern(name)
+        self.group_weight = group_weight
+    
+    @classmethod
+    def from_dict(cls, group):
+        return cls(group['id'], group['name'], group['group_weight'])
+
+class Assignment(_Record):
+    '''
+    The assignment a submission belongs to, with its shared `Group`.
+    '''
+    __slots__ = ('id', 'name', 'points_possible', 'due_at',
+                 'assignment_group_id', 'group')
+    
+    def __init__(self, id, name, points_possible, due_at,
+                 assignment_group_id, group):
+        self.id = id
+        self.name = name
+        self.points_possible = points_possible
+        # Many assignments share a due date, so keep one copy of each
+        self.due_at = due_at if due_at is None else sys.intern(due_at)
+        self.assignment_group_id = assignment_group_id
+        self.group = group
+    
+    @classmethod
+    def from_dict(cls, assignment, group_map):
+        group_id = assignment['assignment_group_id']
+        return cls(assignment['id'], assignment['name'],
+                   assignment['points_possible'], assignment['due_at'],
+                   group_id, group_map[group_id])
+
+class Submission(_Record):
+    '''
+    One submission, holding only the fields the analyzer uses.
+    '''
+    __slots__ = ('assignment_id', 'user_id', 'score', 'workflow_state',
+                 'submitted_at', 'graded_at', 'assignment')
+    
+    def __init__(self, assignment_id, user_id, score, workflow_state,
+                 submitted_at, graded_at, assignment):
+        self.assignment_id = assignment_id
+        self.user_id = user_id
+        self.score = score
+        self.workflow_state = sys.intern(workflow_state)
+        self.submitted_at = submitted_at
+        self.graded_at = graded_at
+        self.assignment = assignment
+    
+    @classmethod
+    def from_dict(cls, submission, group_map):
+        return cls(submission['assignment_id'], submission['user_id'],
+                   submission['score'], submission['workflow_state'],
+                   submission.get('submitted_at'), submission.get('graded_at'),
+                   Assignment.from_dict(submission['assignment'], group_map))
+
+def iter_submissions(user_id, course_id):
+    '''
+    Streaming version of `get_submissions`. Submissions are yielded one at a
+    time with their group attached, decoded incrementally from the cached
+    JSON text or page by page from Canvas, so the whole list is never held
+    in memory at once. Streamed responses skip the in-memory and
+    write-through caches.
+    
+    Params:
+        user_id (str): The User (e.g., 'hermione') or API token
+        course_id (int): The ID of the course
+    Returns:
+        generator: The submission dictionaries, in the same order and form as
+                   `get_submissions`
+    '''
+    group_map = GROUP_INDEX.get(user_id, course_id)
+    for submission in _iter_list(_submissions_url(course_id), user_id):
+        assignment_group_id = submission['assignment']['assignment_group_id']
+        submission['assignment']['group'] = group_map[assignment_group_id].copy()
+        yield submission
+
+def sync_submissions(user_id, course_id):
+    '''
+    Brings the synced submissions of a course up to date, downloading only
+    the submissions graded since the last sync. The first sync downloads
+    everything. The merged submissions and the sync time are remembered per
+    user and course, apart from the write-through responses, so they are
+    never evicted; with write-through on, they are also stored for `get`.
+    Sample users are never synced, because their cache is fixed.
+    
+    Only graded submissions are downloaded after the first sync, so an
+    assignment created since then is missed until it is graded; until a full
+    resync (e.g., after `clear_live_cache`), the Maximum and Highest trends
+    and the total points possible leave it out.
+    
+    Params:
+        user_id (str): The User (e.g., 'hermione') or API token
+        course_id (int): The ID of the course
+    Returns:
+        tuple: The full list of submissions (as from `get_submissions`), and
+               a list of (old, new) pairs for each submission that changed,
+               where old is None for a submission not seen before. The list
+               is None when everything was downloaded, as there was nothing
+               to compare with.
+    '''
+    url = _submissions_url(course_id)
+    cache_user = _cache_user(user_id)
+    group_map = GROUP_INDEX.get(user_id, course_id)
+    if cache_user in _get_users():
+        return _attach_group_map(get(url, user_id), group_map), []
+    database = _get_live_database()
+    with _DATABASE_LOCK:
+        row = database.execute("""SELECT synced_at, response FROM sync_state
+                                  WHERE user=? AND course_id=?""",
+                               (cache_user, course_id)).fetchone()
+    # Anything graded while this sync runs is picked up by the next one
+    synced_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    if row is None:
+        submissions = _get_via_requests(url, user_id)
+        changes = None
+    else:
+        submissions = json.loads(row[1])
+        positions = {_submission_key(s): index
+                     for index, s in enumerate(submissions)}
+        # New assignments have no grade yet, so they are not in this list
+        changed = _get_via_requests(url, user_id, {'graded_since': row[0]})
+        changes = []
+        for submission in changed:
+            index = positions.get(_submission_key(submission))
+            if index is None:
+                changes.append((None, submission))
+                submissions.append(submission)
+            else:
+                changes.append((submissions[index], submission))
+                submissions[index] = submission
+    with _DATABASE_LOCK:
+        database.execute("""INSERT OR REPLACE INTO sync_state
+                            VALUES (?, ?, ?, ?)""",
+                         (cache_user, course_id, synced_at, json.dumps(submissions)))
+        database.commit()
+    if WRITE_THROUGH:
+        _store_response(url, user_id, submissions)
+    # Otherwise `get` would keep answering with the submissions before the sync
+    MEMORY_CACHE.invalidate(url, user_id)
+    submissions = _attach_group_map(submissions, group_map)
+    if changes is not None:
+        # The replaced submissions are joined too, so callers can compare them
+        _attach_group_map([old for old, new in changes if old is not None], group_map)
+    return submissions, changes
+
+def _submission_key(submission):
+    return (submission['assignment_id'], submission.get('user_id'))
+
+def _iter_list(url, user):
+    '''
+    Yields the items of a list endpoint one at a time, from the cache if it
+    is there, or otherwise from Canvas.
+    
+    Params:
+        url (str): The URL endpoint to access
+        user (str): The User (e.g., 'hermione') or API token
+    Returns:
+        generator: Each item of the endpoint's result
+    '''
+    text = _get_cached_text(url, user)
+    if text:
+        return _iter_json_array(text)
+    return _iter_via_requests(url, user)
+
+def _iter_json_array(text):
+    '''
+    Decodes the items of a JSON array one at a time.
+    
+    Params:
+        text (str): The JSON text of an array
+    Returns:
+        generator: Each decoded item of the array
+    '''
+    index = _WHITESPACE.match(text).end()
+    if not text.startswith('[', index):
+        raise ValueError("Expected a JSON array")
+    index = _WHITESPACE.match(text, index + 1).end()
+    if text.startswith(']', index):
+        return
+    while True:
+        item, index = _DECODER.raw_decode(text, index)
+        yield item
+        index = _WHITESPACE.match(text, index).end()
+        if text.startswith(',', index):
+            index = _WHITESPACE.match(text, index + 1).end()
+        elif text.startswith(']', index):
+            return
+        else:
+            raise ValueError("Expected ',' or ']' at index {}".format(index))
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+async def async_get(url, user):
+    '''
+    Asynchronous version of `get`, with the same cache-then-network lookup.
+    The blocking lookup runs on a thread pool kept just for these calls, so
+    many users' requests can be awaited side by side from one event loop.
+    At most `ASYNC_WORKERS` lookups (by default `HTTP_POOL_SIZE`) run at
+    once; the rest wait their turn in the pool's queue. Raise the limit with
+    `configure_http(async_workers=...)`, together with `pool_size` so that
+    every worker gets a keep-alive connection.
+    
+    Params:
+        url (str): The URL endpoint to access
+        user (str): The User (e.g., 'hermione') or API token
+    Returns:
+        dict or list: The same result as `get`
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_async_executor(), get, url, user)
+
+async def async_get_user(user_id):
+    return await async_get("users/self/profile", user_id)
+
+async def async_get_courses(user_id):
+    return await async_get("courses", user_id)
+
+async def async_get_submissions(user_id, course_id):
+    loop = asyncio.get_running_loop()
+    submissions, group_map = await asyncio.gather(
+        async_get(_submissions_url(course_id), user_id),
+        loop.run_in_executor(_get_async_executor(), GROUP_INDEX.get,
+                             user_id, course_id))
+    return _attach_group_map(submissions, group_map)
+
+class CourseSession:
+    '''
+    One user's view of one course for the duration of a single analysis run.
+    The submissions are fetched and joined with the course's assignment
+    groups (from `GROUP_INDEX`) the first time they are needed, and every
+    later caller shares that result.
+    
+    Params:
+        user_id (str): The User (e.g., 'hermione') or API token
+        course_id (int): The ID of the course being analyzed
+    '''
+    def __init__(self, user_id, course_id):
+        self.user_id = user_id
+        self.course_id = course_id
+        self.fetch_counts = {}
+        self._submissions = None
+    
+    def get(self, url):
+        '''
+        Fetches the URL for this session's user, recording the fetch.
+        
+        Params:
+            url (str): The URL endpoint to access
+        Returns:
+            dict or list: The result of `get` for that URL
+        '''
+        self.fetch_counts[url] = self.fetch_counts.get(url, 0) + 1
+        return get(url, self.user_id)
+    
+    def get_submissions(self):
+        '''
+        Returns the course's submissions joined with their assignment groups,
+        fetching them only on the first call.
+        
+        Returns:
+            list: The same submission dictionaries as `get_submissions`
+        '''
+        if self._submissions is None:
+            submissions = self.get(_submissions_url(self.course_id))
+            group_map = GROUP_INDEX.get(self.user_id, self.course_id)
+            self._submissions = _attach_group_map(submissions, group_map)
+        return self._submissions
+    
+    @property
+    def total_fetches(self):
+        '''
+        Returns:
+            int: How many requests this session has issued in total
+        '''
+        return sum(self.fetch_counts.values())
+
+class CoursePrefetcher:
+    '''
+    Speculatively fetches the submissions of several courses in the
+    background, a few at a time, so that whichever course is picked next is
+    already loaded. Courses that have not started when `cancel` is called
+    are never fetched. Used as a context manager, it cancels on exit.
+    
+    Params:
+        user_id (str): The User (e.g., 'hermione') or API token
+        course_ids (list): The courses to fetch, in the order to fetch them
+        workers (int): Most courses to fetch at once
+    '''
+    def __init__(self, user_id, course_ids, workers=2):
+        self.user_id = user_id
+        self._sessions = {}
+        self._futures = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        for course_id in course_ids:
+            session = CourseSession(user_id, course_id)
+            self._sessions[course_id] = session
+            self._futures[course_id] = self._executor.submit(session.get_submissions)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.cancel()
+    
+    def session(self, course_id):
+        '''
+        Returns the session for a course, waiting for its prefetch to finish
+        if it has already started. A course that was not prefetched, or
+        whose prefetch failed, gets a new session that fetches on first use
+        (so any error is raised there, in the caller's thread).
+        
+        Params:
+            course_id (int): The ID of the course
+        Returns:
+            CourseSession: The course's session
+        '''
+        future = self._futures.get(course_id)
+        if future is not None and not future.cancel():
+            try:
+                future.result()
+                return self._sessions[course_id]
+            except Exception:
+                pass
+        return CourseSession(self.user_id, course_id)
+    
+    def cancel(self):
+        '''
+        Stops fetching courses that have not started yet. Fetches already
+        in progress finish in the background.
+        '''
+        for future in self._futures.values():
+            future.cancel()
+        self._executor.shutdown(wait=False)
+
 # Make sure we are using the right Python version.
 if not sys.version_info >= (3, 0):
     raise Exception("This code is expected to be run in Python 3.x")
@@ -42,26 +552,880 @@ class CanvasException(Exception):
 # Change for different institution
 BASE_URL = 'https://vt.instructure.com/api/v1/'
 
-# Connect to local SQLite database (the cache)
-DATABASE_NAME = 'sample_canvas_data.db'
-if not os.access(DATABASE_NAME, os.F_OK):
-    raise CanvasException(('Error! Could not find a "{0}" file. '
-                           'Make sure that there is a \"{0}\" in the same '
-                           'directory as "{1}.py"! Spelling is very '
-                           'important here.').format(DATABASE_NAME, __file__))
-if not os.access(DATABASE_NAME, os.R_OK):
-    raise CanvasException(('Error! Could not read the "{0}" file. '
-                          'Make sure that it readable by changing its '
-                          'permissions. You may need to get help from '
-                          'your instructor.').format(DATABASE_NAME, __file__))
-DATABASE = sqlite3.connect(DATABASE_NAME)
-
-# Preload the list of available users in the cache
-USERS = DATABASE.execute("""SELECT name FROM users""")
-USERS = [u.lower() for u, in USERS]
-
-# Responses are in the database as JSON data
-DATABASE.text_factory = lambda x: json.loads(x.decode('utf-8'))
+# Live requests share one keep-alive connection pool (see `configure_http`)
+HTTP_POOL_SIZE = 10
+HTTP_TIMEOUT = 30
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# How many pages of one endpoint may be fetched at once (1 means one by one)
+PARALLEL_PAGES = 1
+# How many `async_get` lookups may run at once (0 means `HTTP_POOL_SIZE`)
+ASYNC_WORKERS = 0
+_HTTP_SESSION = None
+_HTTP_SESSION_LOCK = threading.Lock()
+_ASYNC_EXECUTOR = None
+
+def configure_http(pool_size=None, timeout=None, retries=None, backoff=None,
+                   parallel_pages=None, async_workers=None):
+    '''
+    Changes the settings of the shared HTTP client. The current client is
+    closed and a new one is built with the new settings on the next request.
+    
+    Params:
+        pool_size (int): How many keep-alive connections to hold per host
+        timeout (float): Seconds to wait on connecting or reading a response
+        retries (int): How many times to retry a 429 or 5xx response
+        backoff (float): Backoff factor between retries, in seconds
+        parallel_pages (int): How many pages of a paginated endpoint may be
+                              fetched at once, once the page count is known;
+                              keep it at or below `pool_size`
+        async_workers (int): How many `async_get` lookups may run at once
+                             (0 means one per pooled connection)
+    '''
+    global HTTP_POOL_SIZE, HTTP_TIMEOUT, HTTP_RETRIES, HTTP_BACKOFF
+    global PARALLEL_PAGES, ASYNC_WORKERS
+    global _HTTP_SESSION, _ASYNC_EXECUTOR
+    with _HTTP_SESSION_LOCK:
+        if pool_size is not None:
+            HTTP_POOL_SIZE = pool_size
+        if timeout is not None:
+            HTTP_TIMEOUT = timeout
+        if retries is not None:
+            HTTP_RETRIES = retries
+        if backoff is not None:
+            HTTP_BACKOFF = backoff
+        if parallel_pages is not None:
+            PARALLEL_PAGES = parallel_pages
+        if async_workers is not None:
+            ASYNC_WORKERS = async_workers
+        if _HTTP_SESSION is not None:
+            _HTTP_SESSION.close()
+            _HTTP_SESSION = None
+        if _ASYNC_EXECUTOR is not None:
+            _ASYNC_EXECUTOR.shutdown(wait=False)
+            _ASYNC_EXECUTOR = None
+
+def _get_http_session():
+    '''
+    Returns the shared `requests.Session`, creating it on first use. Reusing
+    one session keeps connections to Canvas alive between pages and calls,
+    instead of paying for a new TCP/TLS handshake every time.
+    
+    Returns:
+        requests.Session: The pooled HTTP client
+    '''
+    global _HTTP_SESSION
+    with _HTTP_SESSION_LOCK:
+        if _HTTP_SESSION is None:
+            retry = Retry(total=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF,
+                          status_forcelist=RETRY_STATUSES,
+                          raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                                  pool_maxsize=HTTP_POOL_SIZE,
+                                  max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _HTTP_SESSION = session
+        return _HTTP_SESSION
+
+def _get_async_executor():
+    '''
+    Returns the thread pool that runs `async_get` lookups, creating it on
+    first use with `ASYNC_WORKERS` threads (or `HTTP_POOL_SIZE`, if that is 0).
+    
+    Returns:
+        concurrent.futures.ThreadPoolExecutor: The pool for async lookups
+    '''
+    global _ASYNC_EXECUTOR
+    with _HTTP_SESSION_LOCK:
+        if _ASYNC_EXECUTOR is None:
+            workers = ASYNC_WORKERS or HTTP_POOL_SIZE
+            _ASYNC_EXECUTOR = ThreadPoolExecutor(
+                max_workers=max(1, workers),
+                thread_name_prefix='canvas-async')
+        return _ASYNC_EXECUTOR
+
+class RateLimitScheduler:
+    '''
+    Shares the Canvas API fairly among all of this process's requests.
+    Canvas gives each token a leaky bucket of quota: every response says how
+    much is left (X-Rate-Limit-Remaining) and what the request cost
+    (X-Request-Cost), and once the bucket is empty Canvas answers
+    "403 Forbidden (Rate Limit Exceeded)". The scheduler therefore:
+    
+    * limits how many requests are in flight overall, and for each token,
+      lowering a token's limit as its quota runs out (a new token sends
+      one request first, to learn its quota);
+    * pauses a token that is down to its reserve, or that was throttled,
+      doubling the pause each time it is throttled again;
+    * hands free slots to the waiting tokens in turn, so one user's large
+      job cannot hold up everyone else's requests.
+    
+    Params:
+        max_concurrent (int): Most requests in flight at once, overall
+        max_per_token (int): Most requests in flight at once for one token
+        reserve (float): Quota below which a token is slowed to one request
+                         at a time
+        delay (float): Seconds to pause a token the first time it is
+                       throttled
+        max_delay (float): Longest pause
+        throttle_retries (int): How many times to resend a request that was
+                                throttled, separately from the HTTP client's
+                                retries of 5xx responses (see
+                                `configure_http`)
+    Attributes:
+        throttled (int): How many throttled (403) responses Canvas sent
+        paused (int): How many times a token was paused
+    '''
+    # Canvas charges each request in flight this much quota up front
+    IN_FLIGHT_COST = 50
+    
+    def __init__(self, max_concurrent=10, max_per_token=10, reserve=100,
+                 delay=1.0, max_delay=30.0, throttle_retries=3):
+        self.max_concurrent = max_concurrent
+        self.max_per_token = max_per_token
+        self.reserve = reserve
+        self.delay = delay
+        self.max_delay = max_delay
+        self.throttle_retries = throttle_retries
+        self.throttled = 0
+        self.paused = 0
+        self._in_flight = 0
+        self._tokens = {}
+        # Tokens with waiting requests, in the order they get their turn
+        self._turns = OrderedDict()
+        self._condition = threading.Condition()
+    
+    def acquire(self, token):
+        '''
+        Waits until a request may be sent with the token.
+        
+        Params:
+            token (str): The API token the request is for
+        '''
+        with self._condition:
+            state = self._tokens.get(token)
+            if state is None:
+                state = self._tokens[token] = _TokenQuota()
+            ticket = [False]
+            state.waiting.append(ticket)
+            self._turns[token] = None
+            while True:
+                self._dispatch()
+                if ticket[0]:
+                    return
+                self._condition.wait(self._until_unpaused())
+    
+    def release(self, token, response=None):
+        '''
+        Frees the request's slot, and learns the token's quota from the
+        response's headers.
+        
+        Params:
+            token (str): The API token the request was for
+            response (requests.Response): The response, or None if the
+                                          request failed
+        '''
+        with self._condition:
+            state = self._tokens[token]
+            state.in_flight -= 1
+            self._in_flight -= 1
+            if response is not None:
+                self._update(state, response)
+            self._condition.notify_all()
+    
+    def limit(self, token):
+        '''
+        Returns:
+            int: How many requests the token may have in flight right now
+        '''
+        with self._condition:
+            return self._limit(self._tokens.get(token) or _TokenQuota())
+    
+    def _limit(self, state):
+        if not state.answered:
+            return 1
+        if state.remaining is None:
+            return self.max_per_token
+        if state.remaining <= self.reserve:
+            return 1
+        per_request = (state.cost or 1) + self.IN_FLIGHT_COST
+        allowed = int((state.remaining - self.reserve) // per_request)
+        return max(1, min(self.max_per_token, allowed))
+    
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._in_flight < self.max_concurrent:
+            for token in list(self._turns):
+                state = self._tokens[token]
+                if not state.waiting:
+                    del self._turns[token]
+                elif state.paused_until <= now and state.in_flight < self._limit(state):
+                    state.waiting.popleft()[0] = True
+                    state.in_flight += 1
+                    self._in_flight += 1
+                    # Everyone else goes before this token's next request
+                    self._turns.move_to_end(token)
+                    self._condition.notify_all()
+                    break
+            else:
+                return
+    
+    def _until_unpaused(self):
+        now = time.monotonic()
+        pauses = [self._tokens[token].paused_until - now for token in self._turns
+                  if self._tokens[token].paused_until > now]
+        return min(pauses) if pauses else None
+    
+    def _update(self, state, response):
+        now = time.monotonic()
+        state.answered = True
+        if _is_throttled(response):
+            self.throttled += 1
+            state.remaining = 0
+            state.pause = min(self.max_delay, state.pause * 2 or self.delay)
+            state.paused_until = now + state.pause
+            self.paused += 1
+            return
+        state.pause = 0
+        try:
+            state.remaining = float(response.headers['X-Rate-Limit-Remaining'])
+        except (KeyError, ValueError):
+            return
+        try:
+            cost = float(response.headers['X-Request-Cost'])
+            state.cost = cost if state.cost is None else 0.8 * state.cost + 0.2 * cost
+        except (KeyError, ValueError):
+            pass
+        if state.remaining <= self.reserve:
+            # The bucket leaks, so the emptier it is, the longer to wait
+            state.paused_until = now + self.delay * (1 - state.remaining / self.reserve)
+            self.paused += 1
+
+class _TokenQuota:
+    __slots__ = ('answered', 'remaining', 'cost', 'in_flight', 'waiting',
+                 'pause', 'paused_until')
+    
+    def __init__(self):
+        self.answered = False
+        self.remaining = None
+        self.cost = None
+        self.in_flight = 0
+        self.waiting = deque()
+        self.pause = 0
+        self.paused_until = 0
+
+def _is_throttled(response):
+    return response.status_code == 403 and b'Rate Limit Exceeded' in response.content
+
+# Every live request goes through the scheduler (see `configure_rate_limits`)
+SCHEDULER = RateLimitScheduler()
+
+def configure_rate_limits(max_concurrent=None, max_per_token=None,
+                          reserve=None, delay=None, max_delay=None,
+                          throttle_retries=None):
+    '''
+    Changes the limits of the shared request scheduler. See
+    `RateLimitScheduler` for what each one means.
+    '''
+    with SCHEDULER._condition:
+        if max_concurrent is not None:
+            SCHEDULER.max_concurrent = max_concurrent
+        if max_per_token is not None:
+            SCHEDULER.max_per_token = max_per_token
+        if reserve is not None:
+            SCHEDULER.reserve = reserve
+        if delay is not None:
+            SCHEDULER.delay = delay
+        if max_delay is not None:
+            SCHEDULER.max_delay = max_delay
+        if throttle_retries is not None:
+            SCHEDULER.throttle_retries = throttle_retries
+        SCHEDULER._condition.notify_all()
+
+# The local SQLite database (the cache) is opened on first use. Setting the
+# CANVAS_DATABASE environment variable points it at another copy.
+DATABASE_NAME = os.environ.get('CANVAS_DATABASE', 'sample_canvas_data.db')
+_DATABASE = None
+_USERS = None
+_DATABASE_LOCK = threading.Lock()
+_DATABASE_INIT_LOCK = threading.Lock()
+
+def _get_database():
+    '''
+    Returns the connection to the cache, opening it on first use.
+    
+    Returns:
+        sqlite3.Connection: The shared connection to the cache
+    '''
+    global _DATABASE
+    if _DATABASE is None:
+        with _DATABASE_INIT_LOCK:
+            if _DATABASE is None:
+                _check_database_file()
+                _DATABASE = _connect(DATABASE_NAME)
+    return _DATABASE
+
+def _get_users():
+    '''
+    Returns the sample users in the cache, loading them on first use. If
+    there is no cache file, there are no sample users and every request goes
+    to Canvas. The users are read without opening the cache itself, so that
+    requests with a real API token never touch the cache unless they need
+    it (see `_get_database`).
+    
+    Returns:
+        set: The lowercased names of the users in the cache
+    '''
+    global _USERS
+    if _USERS is None:
+        with _DATABASE_INIT_LOCK:
+            if _USERS is None:
+                _USERS = _load_users()
+    return _USERS
+
+def _load_users():
+    '''
+    Reads the sample users, through the cache if it is already open, or
+    else through a short-lived connection that leaves the file as it is.
+    
+    Returns:
+        set: The lowercased names of the users in the cache, or an empty
+             set if there is no cache file
+    '''
+    if _DATABASE is not None:
+        database = _DATABASE
+    elif not os.access(DATABASE_NAME, os.F_OK):
+        return set()
+    else:
+        _check_database_file()
+        database = sqlite3.connect(DATABASE_NAME)
+    try:
+        with _DATABASE_LOCK:
+            users = database.execute("""SELECT name FROM users""").fetchall()
+    finally:
+        if database is not _DATABASE:
+            database.close()
+    return {u.lower() for u, in users}
+
+def _check_database_file():
+    if not os.access(DATABASE_NAME, os.F_OK):
+        raise CanvasException(('Error! Could not find a "{0}" file. '
+                               'Make sure that there is a \"{0}\" in the same '
+                               'directory as "{1}.py"! Spelling is very '
+                               'important here.').format(DATABASE_NAME, __file__))
+    if not os.access(DATABASE_NAME, os.R_OK):
+        raise CanvasException(('Error! Could not read the "{0}" file. '
+                              'Make sure that it readable by changing its '
+                              'permissions. You may need to get help from '
+                              'your instructor.').format(DATABASE_NAME, __file__))
+
+def __getattr__(name):
+    # DATABASE and USERS used to be loaded when the module was imported
+    if name == 'DATABASE':
+        return _get_database()
+    if name == 'USERS':
+        return _get_users()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def _connect(database_name):
+    '''
+    Opens the cache database, making sure its lookups are indexed. The
+    columns and tables that live responses and syncs need are only added
+    once they are used (see `_get_live_database`), so reading sample data
+    leaves the rest of the file as it is.
+    
+    Params:
+        database_name (str): The path of the SQLite cache file
+    Returns:
+        sqlite3.Connection: A connection that any thread may use, one query
+                            at a time (see `_DATABASE_LOCK`)
+    '''
+    database = sqlite3.connect(database_name, check_same_thread=False,
+                               factory=_CacheConnection)
+    _ensure_cache_index(database)
+    return database
+
+def _get_live_database():
+    '''
+    Returns the connection to the cache, first adding the columns and tables
+    that live responses and syncs are stored with, if this connection has
+    not yet.
+    
+    Returns:
+        sqlite3.Connection: The shared connection to the cache
+    '''
+    database = _get_database()
+    if not database.live_schema:
+        with _DATABASE_LOCK:
+            if not database.live_schema:
+                _ensure_cache_columns(database)
+                _ensure_sync_table(database)
+                database.live_schema = True
+    return database
+
+class _CacheConnection(sqlite3.Connection):
+    '''
+    A connection to the cache that also keeps a running total of how many
+    bytes of live responses the cache holds, so that storing a response
+    does not have to add up every other one (see `_evict_responses`).
+    The total starts out unknown, and is counted once when first needed.
+    It also remembers whether the live schema has been checked.
+    '''
+    live_bytes = None
+    live_schema = False
+
+def _ensure_cache_index(database):
+    '''
+    Makes sure the responses table has an index on (user, url), so that a
+    cache lookup is a single index probe instead of a full table scan. The
+    sample cache comes with the index built, so opening it writes nothing,
+    and a read-only cache file is left as it is.
+    
+    Params:
+        database (sqlite3.Connection): A connection to the cache
+    '''
+    try:
+        database.execute("""CREATE INDEX IF NOT EXISTS responses_user_url
+                            ON responses (user, url)""")
+        database.commit()
+    except sqlite3.OperationalError:
+        pass
+
+def _ensure_sync_table(database):
+    '''
+    Adds the table that remembers when each user's course was last synced
+    by `sync_submissions`, and the submissions as of then. A read-only cache
+    file is left as it is.
+    
+    Params:
+        database (sqlite3.Connection): A connection to the cache
+    '''
+    try:
+        database.execute("""CREATE TABLE IF NOT EXISTS sync_state
+                            (user text, course_id integer, synced_at text,
+                             response text, PRIMARY KEY (user, course_id))""")
+        database.commit()
+    except sqlite3.OperationalError:
+        pass
+
+def _ensure_cache_columns(database):
+    '''
+    Adds the `fetched_at` column that live responses are stamped with, the
+    `etag` and `last_modified` validators used to revalidate them, and the
+    `size` of each response in bytes. The sample responses leave these
+    empty, and so never expire. Live responses are also indexed by when they
+    were fetched, oldest first, for eviction. A read-only cache file is left
+    as it is.
+    
+    Params:
+        database (sqlite3.Connection): A connection to the cache
+    '''
+    columns = [row[1] for row in database.execute("PRAGMA table_info(responses)")]
+    for name, column_type in [('fetched_at', 'real'), ('etag', 'text'),
+                              ('last_modified', 'text'), ('size', 'integer')]:
+        if name not in columns:
+            try:
+                database.execute("ALTER TABLE responses ADD COLUMN {} {}".format(
+                    name, column_type))
+                if name == 'size':
+                    # Live responses stored before sizes were recorded
+                    database.execute("""UPDATE responses
+                                        SET size=LENGTH(CAST(response AS BLOB))
+                                        WHERE fetched_at IS NOT NULL""")
+                database.commit()
+            except sqlite3.OperationalError:
+                pass
+    try:
+        # Holds the size too, so that eviction never reads the responses
+        database.execute("""CREATE INDEX IF NOT EXISTS responses_fetched_at
+                            ON responses (fetched_at, size)""")
+        database.commit()
+    except sqlite3.OperationalError:
+        pass
+
+# Live responses are only written to the cache when this is turned on
+# (see `configure_cache`)
+WRITE_THROUGH = False
+CACHE_TTL = 60 * 60
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def configure_cache(write_through=None, ttl=None, max_bytes=None):
+    '''
+    Changes how live responses are kept in the local cache.
+    
+    Params:
+        write_through (bool): Whether to store live responses in the cache
+                              and serve them from there until they expire
+        ttl (float): Seconds a stored live response stays fresh
+        max_bytes (int): Most bytes of live responses to keep; the oldest
+                         are evicted first
+    '''
+    global WRITE_THROUGH, CACHE_TTL, CACHE_MAX_BYTES
+    if write_through is not None:
+        WRITE_THROUGH = write_through
+    if ttl is not None:
+        CACHE_TTL = ttl
+    if max_bytes is not None:
+        CACHE_MAX_BYTES = max_bytes
+
+def clear_live_cache():
+    '''
+    Removes every stored live response and synced course, leaving the
+    sample data alone. The next sync of a course downloads all of it.
+    '''
+    database = _get_live_database()
+    with _DATABASE_LOCK:
+        database.execute("DELETE FROM responses WHERE fetched_at IS NOT NULL")
+        database.execute("DELETE FROM sync_state")
+        database.commit()
+        database.live_bytes = 0
+
+class MemoryCache:
+    '''
+    A bounded, least-recently-used cache of decoded responses, kept in
+    memory in front of the SQLite cache and the network. Values are copied
+    when stored and again when read, so a caller that mutates its result
+    (as `get_submissions` does) never changes what the next caller gets.
+    
+    Params:
+        max_entries (int): Most responses to keep; 0 turns the cache off
+        max_bytes (int): Most bytes of response JSON to keep
+        max_age (float): Seconds an entry stays usable, or None for no limit
+    '''
+    def __init__(self, max_entries=0, max_bytes=16 * 1024 * 1024, max_age=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, key):
+        '''
+        Looks up a response, marking it as recently used.
+        
+        Params:
+            key (tuple): The (normalized url, cache user) of the response
+        Returns:
+            dict or list: A copy of the stored response, or `MISSING`
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.max_age is not None:
+                if entry[2] < time.time() - self.max_age:
+                    self._remove(key)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[0]
+        return _copy_json(value)
+    
+    def put(self, key, value, size):
+        '''
+        Stores a copy of a response, evicting the least recently used ones
+        until the cache is back within its limits.
+        
+        Params:
+            key (tuple): The (normalized url, cache user) of the response
+            value (dict or list): The decoded response
+            size (int): The size of the response's JSON text, in bytes
+        '''
+        if not self.max_entries or size > self.max_bytes:
+            return
+        value = _copy_json(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.time())
+            self.size += size
+            while (len(self._entries) > self.max_entries
+                   or self.size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+    
+    def invalidate(self, url=None, user=None):
+        '''
+        Forgets stored responses. With no arguments everything is forgotten,
+        otherwise only the responses matching the given URL and/or user.
+        
+        Params:
+            url (str): The URL endpoint to forget
+            user (str): The User (e.g., 'hermione') or API token to forget
+        '''
+        url = None if url is None else _normalize_url(url)
+        user = None if user is None else _cache_user(user)
+        with self._lock:
+            for key in list(self._entries):
+                if url in (None, key[0]) and user in (None, key[1]):
+                    self._remove(key)
+    
+    def _remove(self, key):
+        value, size, stored_at = self._entries.pop(key)
+        self.size -= size
+
+# Marks a lookup that found nothing (a response could itself be empty)
+MISSING = object()
+
+def _copy_json(value):
+    '''
+    Copies decoded JSON data. This is much quicker than `copy.deepcopy`,
+    because JSON data is only ever nested dicts and lists.
+    
+    Params:
+        value: Any decoded JSON value
+    Returns:
+        A copy sharing no dicts or lists with the original
+    '''
+    value_type = type(value)
+    if value_type is dict:
+        return {key: _copy_json(item) if type(item) in _CONTAINERS else item
+                for key, item in value.items()}
+    if value_type is list:
+        return [_copy_json(item) if type(item) in _CONTAINERS else item
+                for item in value]
+    return value
+
+_CONTAINERS = (dict, list)
+
+# Off until given a size (see `configure_memory_cache`)
+MEMORY_CACHE = MemoryCache()
+
+class SingleFlight:
+    '''
+    Coalesces concurrent identical requests: while one caller is fetching a
+    key, every other caller asking for the same key waits for that fetch
+    instead of starting its own, and then gets a copy of its result (or
+    its exception).
+    
+    Attributes:
+        enabled (bool): Whether `get` coalesces requests
+        fetches (int): How many fetches were actually made
+        coalesced (int): How many callers shared another caller's fetch,
+                         i.e. how many duplicate fetches were avoided
+    '''
+    def __init__(self):
+        self.enabled = True
+        self.fetches = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+    
+    def do(self, key, fetch):
+        '''
+        Calls `fetch`, unless a call for the same key is already in progress,
+        in which case its result is waited for.
+        
+        Params:
+            key (tuple): What is being fetched, e.g. (normalized url, user)
+            fetch (function): Makes the fetch, taking no arguments
+        Returns:
+            tuple: The decoded JSON result, and whether it was shared from
+                   another caller's fetch
+        '''
+        with self._lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _Flight()
+                self.fetches += 1
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return _copy_json(flight.result), True
+        try:
+            result = fetch()
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            # No one can start waiting once the flight is removed
+            with self._lock:
+                del self._in_flight[key]
+            if flight.waiters and flight.error is None:
+                # The caller may change its result, so waiters copy a copy
+                flight.result = _copy_json(result)
+            flight.done.set()
+        return result, False
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+# On by default (see `configure_coalescing`)
+COALESCER = SingleFlight()
+
+def configure_coalescing(enabled):
+    '''
+    Turns the coalescing of concurrent identical `get` calls on or off.
+    
+    Params:
+        enabled (bool): Whether concurrent identical requests share a fetch
+    '''
+    COALESCER.enabled = enabled
+
+def configure_memory_cache(max_entries=None, max_bytes=None, max_age=None):
+    '''
+    Changes the limits of the in-memory response cache.
+    
+    Params:
+        max_entries (int): Most responses to keep; 0 turns the cache off
+        max_bytes (int): Most bytes of response JSON to keep
+        max_age (float): Seconds an entry stays usable
+    '''
+    if max_entries is not None:
+        MEMORY_CACHE.max_entries = max_entries
+    if max_bytes is not None:
+        MEMORY_CACHE.max_bytes = max_bytes
+    if max_age is not None:
+        MEMORY_CACHE.max_age = max_age
+    if not MEMORY_CACHE.max_entries:
+        MEMORY_CACHE.invalidate()
+
+class Metrics:
+    '''
+    A registry of timings and counters for each endpoint that `get` is used
+    with, so that a slow analysis can be traced to SQLite, JSON decoding, or
+    the network. Nothing is recorded unless `enabled` is set (see
+    `configure_metrics`).
+    
+    Each event is stored under its endpoint (the URL with its IDs replaced
+    by ':id') and its name, as a count, total seconds, and any other
+    counters given with it:
+        memory hit, cache hit, cache miss, not modified, coalesced: a
+            whole call to `get`, by where the response came from
+        sqlite: a cache query in `_get_cached_text`
+        decode: decoding cached JSON in `_get_via_cache` (with bytes)
+        page: one page downloaded by `_get_via_requests` (with bytes and
+              retries; seconds are the round trip until the headers came)
+        page decode: decoding a downloaded page
+        revalidated: Canvas said a cached copy is still current (with
+                     bytes_saved, the size of the body it did not resend)
+        throttled: Canvas refused a page because the token's rate limit was
+                   exceeded (the page is sent again up to
+                   `SCHEDULER.throttle_retries` times)
+    
+    Listeners added with `add_listener` are called with each event as it
+    is recorded, as listener(endpoint, event, seconds, counters).
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.endpoints = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+    
+    def record(self, url, event, seconds=0.0, **counters):
+        '''
+        Adds one event to the totals of the URL's endpoint.
+        
+        Params:
+            url (str): The URL endpoint the event is for
+            event (str): What happened (e.g., 'cache hit')
+            seconds (float): How long it took
+            **counters (int): Anything else to add up, such as bytes=
+        '''
+        endpoint = _ENDPOINT_IDS.sub(':id', _normalize_url(url))
+        with self._lock:
+            totals = self.endpoints.setdefault(endpoint, {}).setdefault(
+                event, {'count': 0, 'seconds': 0.0})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            for name, count in counters.items():
+                totals[name] = totals.get(name, 0) + count
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(endpoint, event, seconds, counters)
+    
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+    
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+    
+    def reset(self):
+        '''
+        Forgets everything recorded so far.
+        '''
+        with self._lock:
+            self.endpoints = {}
+    
+    def summary(self):
+        '''
+        Formats the totals as a table, one block per endpoint.
+        
+        Returns:
+            str: The summary, or an empty string if nothing was recorded
+        '''
+        lines = []
+        with self._lock:
+            for endpoint, events in sorted(self.endpoints.items()):
+                lines.append(endpoint)
+                for event, totals in sorted(events.items()):
+                    extra = "".join("  {} {}".format(totals[name], name)
+                                    for name in sorted(totals)
+                                    if name not in ('count', 'seconds'))
+                    lines.append("    {:<12} {:>7} calls {:>10.4f} s{}".format(
+                        event, totals['count'], totals['seconds'], extra))
+        return "\n".join(lines)
+
+    def dump(self, stream=None):
+        '''
+        Writes the summary, if anything was recorded, to `stream` (standard
+        error by default).
+        '''
+        summary = self.summary()
+        if summary:
+            print("Canvas request metrics:", file=stream or sys.stderr)
+            print(summary, file=stream or sys.stderr)
+
+_ENDPOINT_IDS = re.compile(r"\d+")
+
+# Off until enabled (see `configure_metrics`)
+METRICS = Metrics()
+_METRICS_AT_EXIT = False
+
+def configure_metrics(enabled=None, dump_at_exit=None):
+    '''
+    Turns metrics on or off, and asks for their summary to be written to
+    standard error when the process exits. Setting the CANVAS_METRICS
+    environment variable does both.
+    
+    Params:
+        enabled (bool): Whether to record metrics
+        dump_at_exit (bool): Whether to write `METRICS.summary()` at exit
+    '''
+    global _METRICS_AT_EXIT
+    if enabled is not None:
+        METRICS.enabled = enabled
+    if dump_at_exit is not None:
+        if dump_at_exit and not _METRICS_AT_EXIT:
+            atexit.register(METRICS.dump)
+        elif not dump_at_exit and _METRICS_AT_EXIT:
+            atexit.unregister(METRICS.dump)
+        _METRICS_AT_EXIT = dump_at_exit
+
+if os.environ.get('CANVAS_METRICS'):
+    configure_metrics(enabled=True, dump_at_exit=True)
 
 def get(url, user):
     '''
@@ -79,12 +1443,65 @@ def get(url, user):
         raise TypeError("The URL must be a string.")
     if not isinstance(user, str):
         raise TypeError("The user token must be a string.")
+    if METRICS.enabled:
+        start = time.perf_counter()
+    if MEMORY_CACHE.max_entries or COALESCER.enabled:
+        key = (_normalize_url(url), _cache_user(user))
+    # Recently used responses are still in memory
+    if MEMORY_CACHE.max_entries:
+        result = MEMORY_CACHE.get(key)
+        if result is not MISSING:
+            if METRICS.enabled:
+                METRICS.record(url, 'memory hit', time.perf_counter() - start)
+            return result
+    # Identical requests already in progress are waited for, not repeated
+    if COALESCER.enabled:
+        result, shared = COALESCER.do(key, lambda: _fetch_response(url, user))
+        if shared:
+            if METRICS.enabled:
+                METRICS.record(url, 'coalesced', time.perf_counter() - start)
+            return result
+    else:
+        result = _fetch_response(url, user)
+    if MEMORY_CACHE.max_entries:
+        MEMORY_CACHE.put(key, result, len(json.dumps(result)))
+    return result
+
+def _fetch_response(url, user):
+    '''
+    Gets a response from the local cache, or else from Canvas (storing it
+    in the cache if write-through is on).
+    
+    Params:
+        url (str): The URL endpoint to access
+        user (str): The User (e.g., 'hermione') or API token
+    Returns:
+        dict or list: The response
+    '''
+    if METRICS.enabled:
+        start = time.perf_counter()
     # If a special user, then return the cached result
     rows = _get_via_cache(url, user)
     if rows:
-        return rows[0]
-    # Otherwise, get via the requests module
-    return _get_via_requests(url, user)
+        result = rows[0]
+        event = 'cache hit'
+    elif WRITE_THROUGH:
+        # An expired copy can be revalidated instead of downloaded again
+        stored = _get_stored_response(url, user)
+        result = _get_via_requests(url, user, stored=stored)
+        if stored.not_modified:
+            event = 'not modified'
+            _touch_response(url, user)
+        else:
+            event = 'cache miss'
+            _store_response(url, user, result, stored.etag, stored.last_modified)
+    else:
+        # Otherwise, get via the requests module
+        result = _get_via_requests(url, user)
+        event = 'cache miss'
+    if METRICS.enabled:
+        METRICS.record(url, event, time.perf_counter() - start)
+    return result
 
 def _normalize_url(url):
     '''
@@ -108,60 +1525,462 @@ def _get_via_cache(url, user):
         url (str): The URL endpoint to look up in the cache
         user (str): One of the users in the cache
     Returns:
-        dict or list: Depending on what URL is accessed, will return
-                      a list of all the results or just a single dictionary
+        list: A list holding the cached response (a dict or list, depending
+              on the URL), an empty list if it is not cached, or False if
+              the user is not in the cache at all
+    '''
+    text = _get_cached_text(url, user)
+    if text is False:
+        return False
+    if text is None:
+        return []
+    # Responses are in the database as JSON data
+    if METRICS.enabled:
+        start = time.perf_counter()
+        result = json.loads(text)
+        METRICS.record(url, 'decode', time.perf_counter() - start, bytes=len(text))
+        return [result]
+    return [json.loads(text)]
+
+def _get_cached_text(url, user):
+    '''
+    Retrieves the JSON text of the given user's result for that URL from the
+    local cache, without decoding it.
+    
+    Params:
+        url (str): The URL endpoint to look up in the cache
+        user (str): The User (e.g., 'hermione') or API token
+    Returns:
+        str: The cached JSON text, None if it is not cached, or False if the
+             user's responses are not looked up in the cache at all
     '''
     # Normalize URL and user to find them in the cache
-    normalized_user = user.lower()
+    normalized_user = _cache_user(user)
     normalized_url = _normalize_url(url)
-    if user.lower() in USERS:
+    if METRICS.enabled:
+        start = time.perf_counter()
+    if normalized_user in _get_users():
         # Perform the query selection
-        rows = DATABASE.execute("""SELECT response FROM responses
-                                 WHERE url=? AND user=?""",
-                                 (normalized_url, normalized_user))
-        return [r for r, in rows]
-    return False
+        database = _get_database()
+        with _DATABASE_LOCK:
+            row = _lookup_response(database, normalized_url, normalized_user)
+    elif WRITE_THROUGH:
+        # Live responses only count while they are fresh
+        database = _get_live_database()
+        with _DATABASE_LOCK:
+            row = database.execute(_FRESH_QUERY,
+                                   (normalized_url, normalized_user,
+                                    time.time() - CACHE_TTL)).fetchone()
+    else:
+        return False
+    if METRICS.enabled:
+        METRICS.record(url, 'sqlite', time.perf_counter() - start)
+    return row[0] if row else None
 
-def _get_via_requests(url, token):
-    # Provide token and increase number of results returned to maximum
+def _cache_user(user):
+    '''
+    Returns the key that a user's responses are stored under. Sample users
+    are stored by their lowercased name; real API tokens are case-sensitive
+    secrets, so they are stored by a hash instead.
+    
+    Params:
+        user (str): The User (e.g., 'hermione') or API token
+    Returns:
+        str: The value of the `user` column for that user
+    '''
+    if user.lower() in _get_users():
+        return user.lower()
+    return 'token:' + hashlib.sha256(user.encode('utf-8')).hexdigest()
+
+def describe_user(user):
+    '''
+    Returns a label for a user that is safe to print or log. Sample users are
+    shown by name; real API tokens are secrets, so they are shown by the
+    start of their hash, which still tells different users apart.
+    
+    Params:
+        user (str): The User (e.g., 'hermione') or API token
+    Returns:
+        str: The printable label (e.g., 'hermione' or 'token:3f2a9c1b')
+    '''
+    key = _cache_user(user)
+    if key.startswith('token:'):
+        return key[:len('token:') + 8]
+    return key
+
+def _store_response(url, user, result, etag=None, last_modified=None):
+    '''
+    Writes a live response into the cache, replacing any older copy, and
+    then evicts the oldest live responses beyond `CACHE_MAX_BYTES`.
+    
+    Params:
+        url (str): The URL endpoint that was accessed
+        user (str): The API token it was accessed with
+        result (dict or list): The response to store
+        etag (str): The response's ETag header, if it had one
+        last_modified (str): The response's Last-Modified header, if it had
+                             one
+    '''
+    key = (_normalize_url(url), _cache_user(user))
+    text = json.dumps(result)
+    size = len(text.encode('utf-8'))
+    database = _get_live_database()
+    with _DATABASE_LOCK:
+        replaced = database.execute("""SELECT TOTAL(size) FROM responses
+                                       WHERE url=? AND user=?
+                                       AND fetched_at IS NOT NULL""",
+                                    key).fetchone()[0]
+        database.execute("DELETE FROM responses WHERE url=? AND user=?", key)
+        database.execute("""INSERT INTO responses
+                            (url, user, response, fetched_at, etag, last_modified,
+                             size)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                         key + (text, time.time(), etag, last_modified, size))
+        _evict_responses(database, CACHE_MAX_BYTES, size - int(replaced))
+        database.commit()
+
+class _StoredResponse:
+    '''
+    The cached copy of a live response, whether or not it has expired, and
+    what revalidating it found out.
+    
+    Attributes:
+        text (str): The cached JSON text, or None if nothing is cached
+        etag (str): The ETag to send as If-None-Match, then the new one
+        last_modified (str): The Last-Modified date to send as
+                             If-Modified-Since, then the new one
+        size (int): The size of the cached JSON text in bytes
+        not_modified (bool): Whether Canvas said the copy is still current
+    '''
+    __slots__ = ('text', 'etag', 'last_modified', 'size', 'not_modified')
+    
+    def __init__(self, text=None, etag=None, last_modified=None, size=0):
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = size
+        self.not_modified = False
+    
+    def headers(self):
+        '''
+        Returns:
+            dict: The conditional request headers for the cached copy
+        '''
+        headers = {}
+        if self.text is not None:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+def _get_stored_response(url, user):
+    '''
+    Looks up the cached copy of a live response, even if it has expired.
+    
+    Params:
+        url (str): The URL endpoint to look up
+        user (str): The API token
+    Returns:
+        _StoredResponse: The cached copy and its validators
+    '''
+    key = (_normalize_url(url), _cache_user(user))
+    database = _get_live_database()
+    with _DATABASE_LOCK:
+        row = database.execute("""SELECT response, etag, last_modified, size
+                                  FROM responses WHERE url=? AND user=?
+                                  LIMIT 1""", key).fetchone()
+    return _StoredResponse(*row) if row else _StoredResponse()
+
+def _touch_response(url, user):
+    '''
+    Marks a cached live response as fresh again, after Canvas said it has
+    not changed.
+    
+    Params:
+        url (str): The URL endpoint that was revalidated
+        user (str): The API token
+    '''
+    key = (_normalize_url(url), _cache_user(user))
+    database = _get_live_database()
+    with _DATABASE_LOCK:
+        database.execute("UPDATE responses SET fetched_at=? WHERE url=? AND user=?",
+                         (time.time(),) + key)
+        database.commit()
+
+def _evict_responses(database, max_bytes, added_bytes=0):
+    '''
+    Deletes the least recently fetched live responses until the rest fit in
+    `max_bytes`. The connection's running total of live bytes is updated by
+    `added_bytes`, and only counted from scratch the first time; so a write
+    only reads the rows it evicts, oldest first, from the `fetched_at`
+    index. Writes by other processes are counted when the cache is next
+    opened.
+    
+    Params:
+        database (_CacheConnection): A connection to the cache
+        max_bytes (int): Most bytes of live responses to keep
+        added_bytes (int): How many bytes of live responses were just added
+                           (less those replaced), if the total is known
+    '''
+    if database.live_bytes is None:
+        database.live_bytes = int(database.execute(
+            """SELECT TOTAL(size) FROM responses
+               WHERE fetched_at IS NOT NULL""").fetchone()[0])
+    else:
+        database.live_bytes += added_bytes
+    if database.live_bytes <= max_bytes:
+        return
+    rows = database.execute("""SELECT rowid, size FROM responses
+                               WHERE fetched_at IS NOT NULL
+                               ORDER BY fetched_at""")
+    evicted = []
+    for rowid, size in rows:
+        if database.live_bytes <= max_bytes:
+            break
+        evicted.append((rowid,))
+        database.live_bytes -= size or 0
+    rows.close()
+    database.executemany("DELETE FROM responses WHERE rowid=?", evicted)
+
+def _lookup_response(database, normalized_url, normalized_user):
+    '''
+    Runs the cache query for one response, reading at most one row.
+    
+    Params:
+        database (sqlite3.Connection): A connection to the cache
+        normalized_url (str): The URL endpoint, from `_normalize_url`
+        normalized_user (str): The lowercased user
+    Returns:
+        tuple: The matching (response,) row, or None if there is none
+    '''
+    return database.execute(_CACHE_QUERY,
+                            (normalized_url, normalized_user)).fetchone()
+
+_CACHE_QUERY = """SELECT response FROM responses
+                  WHERE url=? AND user=? LIMIT 1"""
+_FRESH_QUERY = """SELECT response FROM responses
+                  WHERE url=? AND user=? AND fetched_at >= ? LIMIT 1"""
+
+def _get_via_requests(url, token, extra_parameters=None, stored=None):
+    '''
+    Gets every page of a URL endpoint from Canvas.
+    
+    Params:
+        url (str): The URL endpoint to access
+        token (str): The API token
+        extra_parameters (dict): More query parameters to send
+        stored (_StoredResponse): A cached copy to revalidate; it is updated
+                                  with whether Canvas answered 304 Not
+                                  Modified, and with the new validators
+    Returns:
+        dict or list: The response, or the cached copy if not modified
+    '''
     full_url = BASE_URL + url
-    parameters = {}
-    parameters['access_token'] = token
-    parameters['per_page'] = 100
-    if re.match("courses/(\d\d+)/students/submissions", url):
-        parameters["include[]"] = "assignment"
+    parameters = _request_parameters(url, token)
+    if extra_parameters:
+        parameters.update(extra_parameters)
+    if stored is not None:
+        response = _get_page(full_url, parameters, url, stored.headers())
+        if response.status_code == 304:
+            stored.not_modified = True
+            if METRICS.enabled:
+                METRICS.record(url, 'revalidated', bytes_saved=stored.size)
+            return json.loads(stored.text)
+        # Validators only describe this page, so only one-page responses keep them
+        if 'next' in response.links:
+            stored.etag = stored.last_modified = None
+        else:
+            stored.etag = response.headers.get('ETag')
+            stored.last_modified = response.headers.get('Last-Modified')
+    else:
+        response = None
     final_result = []
     # Loop until we get every page of results
     while True:
         # Make the actual request
-        response = requests.get(full_url, parameters)
-        if response.status_code == 404:
-            exception = ("Canvas URL not found for URL '{}'").format(url)
-            raise CanvasException(exception)
-        json_data = response.json()
+        if response is None:
+            response = _get_page(full_url, parameters, url)
+        json_data = _read_page(response, url, token)
         # Inspect the results, return any dictionaries directly
         if isinstance(json_data, dict):
-            if 'errors' in json_data:
-                errors = json_data['errors']
-                if errors:
-                    error_message = errors[0]['message']
-                    if error_message == 'Invalid access token.':
-                        exception= ("Invalid access token '{}' for "
-                                    "URL '{}'. Did you spell the name right?").format(token, url)
-                    else:
-                        exception= ("Canvas error '{}' for "
-                                    "URL '{}'").format(error_message, url)
-                else:
-                    exception = ("General canvas error for "
-                                 "URL '{}'").format(url)
-                raise CanvasException(exception)
             return json_data
         # Otherwise, start building up our list
         final_result.extend(json_data)
+        # Once the last page is known, the rest can be fetched side by side
+        if PARALLEL_PAGES > 1:
+            page_urls = _remaining_page_urls(response.links)
+            if page_urls:
+                for json_data in _get_pages(page_urls, parameters, url, token):
+                    if isinstance(json_data, dict):
+                        return json_data
+                    final_result.extend(json_data)
+                return final_result
         # Check if there's another page of data
         if 'next' in response.links:
             # Now we'll go onto the next page
             full_url = response.links['next']['url']
+            response = None
         else:
             # No more pages, stop here
             return final_result
+
+def _request_parameters(url, token):
+    # Provide token and increase number of results returned to maximum
+    parameters = {}
+    parameters['access_token'] = token
+    parameters['per_page'] = 100
+    if re.match("courses/(\d\d+)/students/submissions", url):
+        parameters["include[]"] = "assignment"
+    return parameters
+
+def _iter_via_requests(url, token):
+    '''
+    Streaming version of `_get_via_requests` for list endpoints. Each page is
+    requested only once the items of the previous page have been used up.
+    
+    Params:
+        url (str): The URL endpoint to access
+        token (str): The API token
+    Returns:
+        generator: Each item of the endpoint's result
+    '''
+    full_url = BASE_URL + url
+    parameters = _request_parameters(url, token)
+    while True:
+        response = _get_page(full_url, parameters, url)
+        json_data = _read_page(response, url, token)
+        if isinstance(json_data, dict):
+            raise CanvasException(("Expected a list of results for "
+                                   "URL '{}'").format(url))
+        # Let go of the response before handing out its items
+        links = response.links
+        del response
+        yield from json_data
+        if 'next' not in links:
+            return
+        full_url = links['next']['url']
+
+def _get_page(full_url, parameters, url, headers=None):
+    '''
+    Requests one page once the scheduler allows it, trying again (after the
+    scheduler's pause) while Canvas says the token is throttled, up to
+    `SCHEDULER.throttle_retries` times.
+    
+    Params:
+        full_url (str): The full URL of the page
+        parameters (dict): The query parameters, including the access token
+        url (str): The URL endpoint that was requested, for metrics
+        headers (dict): Extra request headers
+    Returns:
+        requests.Response: The response for the page
+    '''
+    token = parameters['access_token']
+    for attempt in range(SCHEDULER.throttle_retries + 1):
+        SCHEDULER.acquire(token)
+        response = None
+        try:
+            response = _get_http_session().get(full_url, params=parameters,
+                                               headers=headers,
+                                               timeout=HTTP_TIMEOUT)
+        finally:
+            SCHEDULER.release(token, response)
+        if not _is_throttled(response):
+            break
+        if METRICS.enabled:
+            METRICS.record(url, 'throttled', response.elapsed.total_seconds())
+    return response
+
+def _read_page(response, url, token):
+    '''
+    Decodes one page of a Canvas response, turning Canvas' error responses
+    into CanvasExceptions.
+    
+    Params:
+        response (requests.Response): The response for one page
+        url (str): The URL endpoint that was requested, for error messages
+        token (str): The API token that was used, for error messages
+    Returns:
+        dict or list: The decoded JSON data of the page
+    '''
+    if response.status_code == 404:
+        exception = ("Canvas URL not found for URL '{}'").format(url)
+        raise CanvasException(exception)
+    if _is_throttled(response):
+        exception = ("Canvas rate limit exceeded for URL '{}'").format(url)
+        raise CanvasException(exception)
+    if METRICS.enabled:
+        retries = getattr(getattr(response.raw, 'retries', None), 'history', ())
+        METRICS.record(url, 'page', response.elapsed.total_seconds(),
+                       bytes=len(response.content), retries=len(retries))
+        start = time.perf_counter()
+        json_data = response.json()
+        METRICS.record(url, 'page decode', time.perf_counter() - start)
+    else:
+        json_data = response.json()
+    if isinstance(json_data, dict) and 'errors' in json_data:
+        errors = json_data['errors']
+        if errors:
+            error_message = errors[0]['message']
+            if error_message == 'Invalid access token.':
+                # Real tokens are secrets, so the message only names the user
+                exception= ("Invalid access token '{}' for "
+                            "URL '{}'. Did you spell the name right?").format(
+                                describe_user(token), url)
+            else:
+                exception= ("Canvas error '{}' for "
+                            "URL '{}'").format(error_message, url)
+        else:
+            exception = ("General canvas error for "
+                         "URL '{}'").format(url)
+        raise CanvasException(exception)
+    return json_data
+
+def _remaining_page_urls(links):
+    '''
+    Works out the URLs of every page after the current one from the `next`
+    and `last` links that Canvas sends with each page.
+    
+    Params:
+        links (dict): The parsed Link header of the current page
+    Returns:
+        list: The URLs of the remaining pages in order, or None if they
+              cannot be computed (e.g., Canvas left out the `last` link or
+              used opaque bookmark page numbers)
+    '''
+    if 'next' not in links or 'last' not in links:
+        return None
+    next_url = urlsplit(links['next']['url'])
+    next_query = parse_qs(next_url.query)
+    last_query = parse_qs(urlsplit(links['last']['url']).query)
+    try:
+        first_page = int(next_query['page'][0])
+        last_page = int(last_query['page'][0])
+    except (KeyError, ValueError):
+        return None
+    page_urls = []
+    for page in range(first_page, last_page + 1):
+        next_query['page'] = [str(page)]
+        query = urlencode(next_query, doseq=True)
+        page_urls.append(urlunsplit(next_url._replace(query=query)))
+    return page_urls
+
+def _get_pages(page_urls, parameters, url, token):
+    '''
+    Fetches several pages at once, using at most `PARALLEL_PAGES` requests
+    at a time.
+    
+    Params:
+        page_urls (list): The full URLs of the pages to fetch
+        parameters (dict): The query parameters to send with each page
+        url (str): The URL endpoint that was requested, for error messages
+        token (str): The API token that was used, for error messages
+    Returns:
+        list: The decoded JSON data of each page, in the same order as
+              `page_urls`
+    '''
+    def get_one(page_url):
+        return _read_page(_get_page(page_url, parameters, url), url, token)
+    workers = min(PARALLEL_PAGES, len(page_urls))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(get_one, page_urls))
@@ -0,0 +1,44 @@
+'''
+Helpers shared by the test files.
+
+Tests that open the cache do so through `TemporaryCache`, so that running
+the suite never changes the sample cache file.
+'''
+import copy
+import os
+import random
+import shutil
+import tempfile
+
+import canvas_requests
+
+
+class TemporaryCache:
+    '''
+    Points `canvas_requests` at a throwaway copy of the sample cache, so
+    tests that read or write the cache leave the real file untouched.
+    '''
+    def __enter__(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'cache.db')
+        shutil.copy(canvas_requests.DATABASE_NAME, path)
+        self.old_database = canvas_requests._DATABASE
+        canvas_requests._DATABASE = canvas_requests._connect(path)
+        return canvas_requests._DATABASE
+
+    def __exit__(self, *exc_info):
+        canvas_requests._DATABASE.close()
+        canvas_requests._DATABASE = self.old_database
+        self.directory.cleanup()
+
+
+def shuffled_undated(user_id, course_id):
+    '''
+    Returns a copy of a sample course's submissions in a fixed shuffled order,
+    with two of the assignments' due dates taken away.
+    '''
+    submissions = copy.deepcopy(canvas_requests.get_submissions(user_id, course_id))
+    random.Random(0).shuffle(submissions)
+    submissions[0]["assignment"]["due_at"] = None
+    submissions[5]["assignment"]["due_at"] = None
+    return submissions
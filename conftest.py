@@ -0,0 +1,44 @@
+'''
+Shared pytest setup.
+
+`test_my_solution.py` imports `canvas_analyzer` while it is being collected,
+with matplotlib replaced by a stand-in. When the whole suite runs in one
+process, the other test files have already imported the module with the real
+matplotlib. So the grader gets a fresh import of its own, and the module the
+other tests use is put back once the grader has been collected.
+
+The tests, and any processes they start, use a copy of the sample cache
+through the CANVAS_DATABASE environment variable, so that the tracked file is
+left as it is.
+'''
+import os
+import shutil
+import sys
+import tempfile
+
+_GRADER = 'test_my_solution.py'
+_imported = {}
+_SAMPLE_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'sample_canvas_data.db')
+_directory = tempfile.TemporaryDirectory()
+
+
+def pytest_configure(config):
+    path = os.path.join(_directory.name, 'sample_canvas_data.db')
+    shutil.copy(_SAMPLE_CACHE, path)
+    os.environ['CANVAS_DATABASE'] = path
+
+
+def pytest_unconfigure(config):
+    os.environ.pop('CANVAS_DATABASE', None)
+    _directory.cleanup()
+
+
+def pytest_collectstart(collector):
+    if collector.name == _GRADER and 'canvas_analyzer' in sys.modules:
+        _imported['canvas_analyzer'] = sys.modules.pop('canvas_analyzer')
+
+
+def pytest_collectreport(report):
+    if report.nodeid == _GRADER:
+        sys.modules.update(_imported)
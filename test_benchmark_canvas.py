@@ -0,0 +1,54 @@
+'''
+Smoke tests for `benchmark_canvas.py`, on courses small enough to run with
+the rest of the tests.
+'''
+import contextlib
+import io
+import json
+import unittest
+
+import benchmark_canvas
+import canvas_requests
+from canvas_testing import TemporaryCache
+
+
+class TestBenchmarks(unittest.TestCase):
+    def setUp(self):
+        self.cache = TemporaryCache()
+        self.cache.__enter__()
+
+    def tearDown(self):
+        self.cache.__exit__()
+
+    def test_make_course(self):
+        submissions_text, groups_text = benchmark_canvas.make_course(
+            assignments=10, students=3, groups=2, graded=0.5)
+        submissions = canvas_requests._attach_groups(json.loads(submissions_text),
+                                                     json.loads(groups_text))
+        self.assertEqual(len(submissions), 30)
+        self.assertEqual({s['user_id'] for s in submissions}, {0, 1, 2})
+        self.assertEqual({s['assignment']['group']['name'] for s in submissions},
+                         {'Group 0', 'Group 1'})
+        self.assertTrue(any(s['score'] is None for s in submissions))
+
+    def test_synthetic_cache_restored(self):
+        database = canvas_requests._get_database()
+        course = benchmark_canvas.make_course(assignments=5, students=2)
+        with benchmark_canvas.synthetic_cache({7: course}) as user:
+            self.assertEqual(len(canvas_requests.get_submissions(user, 7)), 10)
+        self.assertIs(canvas_requests._get_database(), database)
+        self.assertIn('hermione', canvas_requests._get_users())
+
+    def test_main_runs(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            benchmark_canvas.main(['--rows', '200', '--assignments', '20',
+                                   '--students', '2', '--repeat', '1',
+                                   '--no-plots'])
+        for name in ['indexed', 'join records', 'get_submissions',
+                     'summarize_groups', 'compute_trends']:
+            self.assertIn(name + ':', output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,358 @@
+'''
+Tests for the non-interactive helpers in `canvas_analyzer.py`.
+
+The graded functions are covered by `test_my_solution.py`; these check the
+extra entry points against the sample users in the local cache.
+'''
+import contextlib
+import copy
+import datetime
+import functools
+import io
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+
+import canvas_analyzer
+import canvas_requests
+from canvas_testing import shuffled_undated
+
+
+def printed(a_function, *args):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        a_function(*args)
+    return output.getvalue()
+
+
+class TestBatchMain(unittest.TestCase):
+    def test_report_matches_summaries(self):
+        report = canvas_analyzer.batch_main(['hermione', 'ron'], workers=4)
+        for user_id in ['hermione', 'ron']:
+            for course_id in canvas_analyzer.get_available_course_ids(user_id):
+                submissions = canvas_requests.get_submissions(user_id, course_id)
+                header = "User: {}, Course: {}\n".format(user_id, course_id)
+                self.assertIn(header + printed(canvas_analyzer.summarize_points,
+                                               submissions), report + "\n")
+                self.assertIn(printed(canvas_analyzer.summarize_groups,
+                                      submissions), report + "\n")
+
+    def test_course_filter_and_processes(self):
+        report = canvas_analyzer.batch_main(['hermione', 'harry'],
+                                            course_ids=[52], workers=2,
+                                            processes=True)
+        headers = [line for line in report.splitlines()
+                   if line.startswith("User: ")]
+        self.assertEqual(headers, ["User: hermione, Course: 52",
+                                   "User: harry, Course: 52"])
+
+    def test_no_courses(self):
+        self.assertEqual(canvas_analyzer.batch_main(['ron'], course_ids=[]), "")
+
+    def test_failing_user_reported(self):
+        get_courses = canvas_requests.get_courses
+
+        def revoked(user_id):
+            if user_id == 'ron':
+                raise canvas_requests.CanvasException("Invalid access token")
+            return get_courses(user_id)
+
+        with patch.object(canvas_requests, 'get_courses', revoked):
+            report = canvas_analyzer.batch_main(['hermione', 'ron', 'harry'],
+                                                course_ids=[52], workers=2)
+        lines = report.splitlines()
+        self.assertEqual(lines[lines.index("User: ron") + 1],
+                         "Error: Invalid access token")
+        headers = [line for line in report.splitlines()
+                   if line.startswith("User: ")]
+        self.assertEqual(headers, ["User: hermione, Course: 52", "User: ron",
+                                   "User: harry, Course: 52"])
+
+    def test_streaming_opt_in(self):
+        expected = canvas_analyzer.analyze_course('hermione', 52)
+        with patch.object(canvas_requests, 'get_submissions',
+                          side_effect=AssertionError("not streamed")):
+            self.assertEqual(canvas_analyzer.analyze_course('hermione', 52,
+                                                            stream=True),
+                             expected)
+        with patch.object(canvas_requests, 'iter_submissions',
+                          side_effect=AssertionError("streamed")):
+            self.assertEqual(canvas_analyzer.analyze_course('hermione', 52),
+                             expected)
+
+    def test_tokens_not_printed(self):
+        token = '1234~SecretToken'
+        with patch.object(canvas_requests, 'get_submissions', return_value=[]):
+            summary = canvas_analyzer.analyze_course(token, 52)
+        report = canvas_analyzer.format_report([summary])
+        self.assertNotIn(token, report)
+        self.assertIn("User: " + canvas_requests.describe_user(token), report)
+        self.assertNotEqual(canvas_requests.describe_user(token),
+                            canvas_requests.describe_user(token + 'x'))
+
+
+class TestGradeReport(unittest.TestCase):
+    def test_consumes_iterator_once(self):
+        submissions = canvas_requests.get_submissions('hermione', 52)
+        reads = []
+
+        def stream():
+            for submission in submissions:
+                reads.append(submission)
+                yield submission
+
+        report = canvas_analyzer.GradeReport(stream())
+        for function in [canvas_analyzer.summarize_points,
+                         canvas_analyzer.summarize_groups]:
+            self.assertEqual(printed(function, report),
+                             printed(function, submissions))
+        self.assertEqual(len(reads), len(submissions))
+
+    def test_trends(self):
+        submissions = canvas_requests.get_submissions('ron', 15)
+        dates, highs, lows, maxes = canvas_analyzer.GradeReport(submissions).trends()
+        self.assertEqual(len(dates), len(submissions))
+        self.assertAlmostEqual(maxes[-1], 100)
+        weighted = [100 * s["assignment"]["points_possible"]
+                    * s["assignment"]["group"]["group_weight"]
+                    for s in submissions]
+        ungraded = sum(points for points, s in zip(weighted, submissions)
+                       if s["score"] is None)
+        self.assertAlmostEqual(highs[-1] - lows[-1], 100 * ungraded / sum(weighted))
+        for high, low, maximum in zip(highs, lows, maxes):
+            self.assertLessEqual(low, high)
+            self.assertLessEqual(high, maximum + 1e-9)
+
+    def test_accepts_records(self):
+        submissions = canvas_requests.get_submissions('hermione', 34)
+        records = canvas_requests.get_submission_records('hermione', 34)
+        for function in [canvas_analyzer.summarize_points,
+                         canvas_analyzer.summarize_groups]:
+            self.assertEqual(printed(function, records),
+                             printed(function, submissions))
+        self.assertEqual(canvas_analyzer.GradeReport(records).trends(),
+                         canvas_analyzer.GradeReport(submissions).trends())
+
+    def test_update_matches_rebuild(self):
+        submissions = canvas_requests.get_submissions('hermione', 52)
+        report = canvas_analyzer.GradeReport(submissions)
+        changed = copy.deepcopy(submissions)
+        changes = []
+        for index, score in [(0, 2), (40, None), (len(changed) - 1, 7)]:
+            changes.append((submissions[index], dict(changed[index], score=score)))
+            changed[index] = changes[-1][1]
+        extra = copy.deepcopy(changed[-1])
+        extra["assignment"]["id"] = -1
+        changes.append((None, extra))
+        changed.append(extra)
+        report.apply(changes)
+        rebuilt = canvas_analyzer.GradeReport(changed)
+        self.assertAlmostEqual(report.points_obtained, rebuilt.points_obtained)
+        self.assertAlmostEqual(report.points_possible_so_far,
+                               rebuilt.points_possible_so_far)
+        self.assertEqual(report.current_grade, rebuilt.current_grade)
+        self.assertEqual(report.group_grades(), rebuilt.group_grades())
+        self.assertEqual(sorted(report.percentages), sorted(rebuilt.percentages))
+        for actual, expected in zip(report.trends(), rebuilt.trends()):
+            for a, e in zip(actual, expected):
+                self.assertAlmostEqual(a, e)
+
+    def test_sync_report(self):
+        report = canvas_analyzer.sync_report('ron', 15)
+        self.assertIs(canvas_analyzer.sync_report('ron', 15, report), report)
+        self.assertEqual(printed(canvas_analyzer.summarize_points, report),
+                         printed(canvas_analyzer.summarize_points,
+                                 canvas_requests.get_submissions('ron', 15)))
+
+    def test_sync_report_rebuilt_after_full_download(self):
+        report = canvas_analyzer.sync_report('ron', 15)
+        submissions = canvas_requests.get_submissions('ron', 15)
+        with patch('canvas_requests.sync_submissions', return_value=(submissions, None)):
+            rebuilt = canvas_analyzer.sync_report('ron', 15, report)
+        self.assertIsNot(rebuilt, report)
+        self.assertEqual(canvas_analyzer.compute_points(rebuilt),
+                         canvas_analyzer.compute_points(report))
+        self.assertEqual(rebuilt.percentages, report.percentages)
+
+    def test_nothing_graded(self):
+        report = canvas_analyzer.GradeReport()
+        self.assertIsNone(report.current_grade)
+        self.assertEqual(report.group_grades(), {})
+
+
+class TestTimeline(unittest.TestCase):
+    def test_parse_matches_strptime(self):
+        due_at = "2017-08-30T16:20:00Z"
+        self.assertEqual(canvas_analyzer.parse_due_date(due_at),
+                         datetime.datetime.strptime(due_at, "%Y-%m-%dT%H:%M:%SZ"))
+        self.assertIs(canvas_analyzer.parse_due_date(due_at),
+                      canvas_analyzer.parse_due_date(due_at))
+        self.assertIsNone(canvas_analyzer.parse_due_date(None))
+
+    def test_trends_sorted_by_due_date(self):
+        submissions = canvas_requests.get_submissions('ron', 23)
+        shuffled = shuffled_undated('ron', 23)
+        undated = [shuffled[0], shuffled[5]]
+        timeline = canvas_analyzer.build_timeline(shuffled)
+        self.assertEqual([submission for date, submission in timeline[-2:]], undated)
+        dates = [date for date, submission in timeline]
+        self.assertEqual(dates, sorted(dates))
+        self.assertEqual(dates[-1], dates[-3])
+        dated = [s for s in submissions
+                 if s["assignment"]["id"] not in {u["assignment"]["id"] for u in undated}]
+        self.assertEqual([s["assignment"]["id"] for date, s in timeline[:-2]],
+                         [s["assignment"]["id"] for s in dated])
+        report_dates, highs, lows, maxes = canvas_analyzer.GradeReport(shuffled).trends()
+        self.assertEqual(list(report_dates), dates)
+        self.assertAlmostEqual(maxes[-1], 100)
+        expected = canvas_analyzer.GradeReport([s for date, s in timeline]).trends()
+        self.assertEqual((highs, lows, maxes), expected[1:])
+
+
+class TestComputeTrends(unittest.TestCase):
+    def test_matches_plotted_series(self):
+        report = canvas_analyzer.GradeReport(canvas_requests.get_submissions('hermione', 52))
+        dates, highs, lows, maxes = report.trends()
+        series = json.loads(json.dumps(canvas_analyzer.compute_trends(report)))
+        self.assertEqual(tuple(series["highest"]), highs)
+        self.assertEqual(tuple(series["lowest"]), lows)
+        self.assertEqual(tuple(series["maximum"]), maxes)
+        self.assertEqual(tuple(canvas_analyzer.parse_due_date(date) for date in series["dates"]),
+                         dates)
+
+    def test_lines_shared_with_report(self):
+        report = canvas_analyzer.GradeReport(canvas_requests.get_submissions('ron', 15))
+        dates, highs, lows, maxes = report.trends()
+        series = canvas_analyzer.compute_trends(report)
+        self.assertIs(series["highest"], highs)
+        self.assertIs(series["lowest"], lows)
+        self.assertIs(series["maximum"], maxes)
+        self.assertIsInstance(maxes, tuple)
+
+    def test_skips_matplotlib(self):
+        code = ("import sys, canvas_analyzer, canvas_requests\n"
+                "canvas_analyzer.compute_trends(canvas_requests.get_submissions('ron', 15))\n"
+                "print('matplotlib' in sys.modules)")
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         universal_newlines=True)
+        self.assertEqual(output.strip(), 'False')
+
+
+class TestAllCourses(unittest.TestCase):
+    def test_every_course_summarized(self):
+        output = printed(canvas_analyzer.summarize_all_courses, 'hermione')
+        course_ids = canvas_analyzer.get_available_course_ids('hermione')
+        for course_id in course_ids:
+            summary = canvas_analyzer.analyze_course('hermione', course_id)
+            self.assertIn(canvas_analyzer.format_report([summary]) + "\n", output)
+        self.assertIn("Courses analyzed: {}, with errors: 0".format(len(course_ids)),
+                      output)
+
+    def test_results_streamed_as_finished(self):
+        analyze_course = canvas_analyzer.analyze_course
+
+        def slow_for_52(user_id, course_id):
+            if course_id == 52:
+                time.sleep(0.2)
+            return analyze_course(user_id, course_id)
+
+        with patch('canvas_analyzer.analyze_course', slow_for_52):
+            courses = [summary["course"] for summary in
+                       canvas_analyzer.iter_course_summaries('ron', [52, 15, 23])]
+        self.assertEqual(sorted(courses), [15, 23, 52])
+        self.assertEqual(courses[-1], 52)
+
+    def test_overview(self):
+        summaries = [{"user": "ron", "course": 1, "grade": 90},
+                     {"user": "ron", "course": 2, "grade": 71},
+                     {"user": "ron", "course": 3, "grade": None},
+                     {"user": "ron", "course": 4, "error": "Canvas URL not found"}]
+        self.assertEqual(canvas_analyzer.format_overview(summaries),
+                         "Courses analyzed: 4, with errors: 1\n"
+                         "Average grade: 80\n"
+                         "Highest grade: 90 in course 1\n"
+                         "Lowest grade: 71 in course 2")
+        self.assertEqual(canvas_analyzer.format_overview([]),
+                         "Courses analyzed: 0, with errors: 0")
+
+
+class TestPrefetch(unittest.TestCase):
+    def tearDown(self):
+        canvas_analyzer.configure_prefetch(courses=0)
+
+    def run_main(self):
+        with patch('builtins.input', lambda prompt: '23'), \
+                patch('canvas_analyzer.get_pyplot'):
+            return printed(canvas_analyzer.main, 'harry')
+
+    def test_main_output_unchanged(self):
+        expected = self.run_main()
+        canvas_analyzer.configure_prefetch(courses=1)
+        fetched = []
+        original = canvas_requests.CourseSession.get_submissions
+
+        def get_submissions(session):
+            fetched.append(session.course_id)
+            return original(session)
+
+        with patch('canvas_requests.CourseSession.get_submissions', get_submissions):
+            self.assertEqual(self.run_main(), expected)
+        # Only the first listed course is prefetched, and the chosen one is fetched as usual
+        self.assertEqual(sorted(set(fetched)), [23, 52])
+
+
+class TestPlotting(unittest.TestCase):
+    def tearDown(self):
+        canvas_analyzer.configure_plots(headless=False, plot_format="png")
+
+    def test_text_only_run_skips_matplotlib(self):
+        code = ("import sys, canvas_analyzer\n"
+                "canvas_analyzer.batch_main(['ron'])\n"
+                "print('matplotlib' in sys.modules)")
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         universal_newlines=True)
+        self.assertEqual(output.strip(), 'False')
+
+    def test_batch_plots_saved_headless(self):
+        canvas_analyzer.configure_plots(plot_format="svg")
+        with tempfile.TemporaryDirectory() as directory:
+            report = canvas_analyzer.batch_main(['hermione'], course_ids=[52, 34],
+                                                workers=2,
+                                                plot_directory=directory)
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['0000_52_scores.svg', '0000_52_trends.svg',
+                              '0001_34_scores.svg', '0001_34_trends.svg'])
+            self.assertIn("Plot: " + os.path.join(directory, '0001_34_trends.svg'),
+                          report)
+        # Threads save their plots without switching the process to headless mode
+        self.assertFalse(canvas_analyzer.HEADLESS)
+
+    def test_spawned_workers_use_plot_settings(self):
+        canvas_analyzer.configure_plots(plot_format="svg")
+        spawn = functools.partial(ProcessPoolExecutor,
+                                  mp_context=multiprocessing.get_context("spawn"))
+        with tempfile.TemporaryDirectory() as directory, \
+             patch.object(canvas_analyzer, 'ProcessPoolExecutor', spawn):
+            canvas_analyzer.batch_main(['hermione'], course_ids=[34], workers=1,
+                                       processes=True, plot_directory=directory)
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['0000_34_scores.svg', '0000_34_trends.svg'])
+
+    def test_plot_saved_to_file(self):
+        submissions = canvas_requests.get_submissions('ron', 15)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'scores.png')
+            canvas_analyzer.plot_scores(submissions, filename)
+            with open(filename, 'rb') as png:
+                self.assertEqual(png.read(8), b'\x89PNG\r\n\x1a\n')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+'''
+Tests that the NumPy backend in `canvas_columns.py` agrees with the pure
+Python computations in `canvas_analyzer.py` on the sample data.
+'''
+import unittest
+
+import canvas_analyzer
+import canvas_columns
+import canvas_requests
+from canvas_testing import shuffled_undated
+
+SAMPLES = [('hermione', 52), ('hermione', 34), ('ron', 15), ('harry', 23)]
+
+
+@unittest.skipIf(canvas_columns.numpy is None, "NumPy is not installed")
+class TestColumns(unittest.TestCase):
+    def each_sample(self):
+        for user_id, course_id in SAMPLES:
+            submissions = canvas_requests.get_submissions(user_id, course_id)
+            yield (canvas_analyzer.GradeReport(submissions),
+                   canvas_columns.SubmissionColumns(submissions))
+
+    def test_weighted_grade(self):
+        for report, columns in self.each_sample():
+            self.assertEqual(canvas_columns.weighted_grade(columns),
+                             canvas_analyzer.compute_points(report))
+
+    def test_group_grades(self):
+        for report, columns in self.each_sample():
+            grades = canvas_columns.group_grades(columns)
+            self.assertEqual(list(grades.items()),
+                             list(report.group_grades().items()))
+
+    def test_percentages(self):
+        for report, columns in self.each_sample():
+            self.assertEqual(canvas_columns.score_percentages(columns).tolist(),
+                             report.percentages)
+            counts, edges = canvas_columns.score_histogram(columns)
+            self.assertEqual(counts.sum(), len(report.percentages))
+
+    def test_trends(self):
+        for report, columns in self.each_sample():
+            dates, highs, lows, maxes = report.trends()
+            due_at, *lines = canvas_columns.grade_trends(columns)
+            self.assertEqual(tuple(due_at.astype(object).tolist()), dates)
+            self.assertEqual([tuple(line.tolist()) for line in lines],
+                             [highs, lows, maxes])
+
+    def test_trends_out_of_order(self):
+        submissions = shuffled_undated('hermione', 52)
+        dates, highs, lows, maxes = canvas_analyzer.GradeReport(submissions).trends()
+        due_at, *lines = canvas_columns.grade_trends(
+            canvas_columns.SubmissionColumns(submissions))
+        self.assertEqual(tuple(due_at.astype(object).tolist()), dates)
+        self.assertEqual([tuple(line.tolist()) for line in lines],
+                         [highs, lows, maxes])
+
+    def test_no_submissions(self):
+        columns = canvas_columns.SubmissionColumns([])
+        self.assertEqual(canvas_columns.weighted_grade(columns), (0.0, 0.0, None))
+        self.assertEqual(canvas_columns.group_grades(columns), {})
+        self.assertEqual(len(canvas_columns.score_percentages(columns)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
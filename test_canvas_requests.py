@@ -0,0 +1,1011 @@
+'''
+Tests for the data access helpers in `canvas_requests.py`.
+
+Cached paths use the sample users in the local database, and live paths
+run against a stand-in Canvas server on localhost.
+'''
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import canvas_requests
+from canvas_testing import TemporaryCache
+
+
+class StandInCanvas:
+    '''
+    A small local HTTP server that answers like the Canvas API, so live
+    request paths can be exercised without touching the real site.
+    
+    Params:
+        pages (dict): Maps each path (e.g. 'courses') to a list of pages,
+                      where every page is the JSON data to send back
+        failures (int): How many 503 responses to send before succeeding
+        delay (float): Seconds to wait before answering each request
+        bucket (LeakyBucket): Rate limits to enforce per access token
+        validators (bool): Whether to send ETag and Last-Modified headers and
+                           answer matching conditional requests with 304
+    '''
+    def __init__(self, pages, failures=0, delay=0, bucket=None, validators=False):
+        self.pages = pages
+        self.failures = failures
+        self.delay = delay
+        self.bucket = bucket
+        self.validators = validators
+        self.conditional = []
+        self.connections = 0
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.requests = []
+        self.queries = []
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stand_in.lock:
+                    stand_in.connections += 1
+
+            def do_GET(self):
+                stand_in.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/api/v1/'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        self.old_base_url = canvas_requests.BASE_URL
+        self.old_backoff = canvas_requests.HTTP_BACKOFF
+        canvas_requests.BASE_URL = self.url
+        canvas_requests.configure_http(backoff=0)
+        return self
+
+    def __exit__(self, *exc_info):
+        canvas_requests.BASE_URL = self.old_base_url
+        canvas_requests.configure_http(backoff=self.old_backoff)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler):
+        parts = urlsplit(handler.path)
+        path = parts.path[len('/api/v1/'):]
+        query = parse_qs(parts.query)
+        page = int(query.get('page', ['1'])[0])
+        with self.lock:
+            self.requests.append((path, page))
+            self.queries.append(query)
+            self.conditional.append((handler.headers.get('If-None-Match'),
+                                     handler.headers.get('If-Modified-Since')))
+            fail = self.failures > 0
+            if fail:
+                self.failures -= 1
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            headers = {}
+            if self.bucket is not None:
+                token = query.get('access_token', [''])[0]
+                remaining = self.bucket.take(token)
+                if remaining is None:
+                    self.send_throttled(handler)
+                    return
+                headers = {'X-Rate-Limit-Remaining': str(remaining),
+                           'X-Request-Cost': str(self.bucket.cost)}
+            self.respond(handler, path, page, fail, headers)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def respond(self, handler, path, page, fail, headers):
+        if fail:
+            self.send(handler, 503, {'errors': []})
+            return
+        if path not in self.pages:
+            self.send(handler, 404, {'errors': []})
+            return
+        pages = self.pages[path]
+        link = '<{}{}?page={{}}&per_page=100>; rel="{{}}"'.format(self.url, path)
+        links = [link.format(len(pages), 'last')]
+        if page < len(pages):
+            links.append(link.format(page + 1, 'next'))
+        if self.validators:
+            etag = '"{}"'.format(hash(json.dumps(pages[page - 1])))
+            if handler.headers.get('If-None-Match') == etag:
+                handler.send_response(304)
+                handler.send_header('ETag', etag)
+                handler.end_headers()
+                return
+            headers = dict(headers, ETag=etag,
+                           **{'Last-Modified': 'Wed, 21 Oct 2026 07:28:00 GMT'})
+        self.send(handler, 200, pages[page - 1], links, headers)
+
+    def send(self, handler, status, data, links=(), headers={}):
+        body = json.dumps(data).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        if links:
+            handler.send_header('Link', ', '.join(links))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def send_throttled(self, handler):
+        # Canvas answers throttled requests with plain text
+        body = b'403 Forbidden (Rate Limit Exceeded)'
+        handler.send_response(403)
+        handler.send_header('Content-Type', 'text/plain')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+class LeakyBucket:
+    '''
+    Canvas-style rate limits for `StandInCanvas`: every token has a bucket
+    that each request fills by `cost` and that drains at `leak_rate` per
+    second. A request that would overflow the bucket is throttled.
+    '''
+    def __init__(self, capacity, leak_rate, cost=1):
+        self.capacity = capacity
+        self.leak_rate = leak_rate
+        self.cost = cost
+        self.throttled = 0
+        self.levels = {}
+        self.lock = threading.Lock()
+
+    def take(self, token):
+        '''
+        Returns the quota left after charging a request, or None if the
+        request is throttled.
+        '''
+        with self.lock:
+            now = time.monotonic()
+            level, then = self.levels.get(token, (0, now))
+            level = max(0, level - (now - then) * self.leak_rate)
+            if level + self.cost > self.capacity:
+                self.levels[token] = (level, now)
+                self.throttled += 1
+                return None
+            self.levels[token] = (level + self.cost, now)
+            return self.capacity - level - self.cost
+
+
+class TestCourseSession(unittest.TestCase):
+    def test_submissions_fetched_once(self):
+        session = canvas_requests.CourseSession('hermione', 52)
+        first = session.get_submissions()
+        for _ in range(3):
+            self.assertIs(session.get_submissions(), first)
+        self.assertEqual(session.fetch_counts,
+                         {'courses/52/students/submissions': 1})
+        self.assertEqual(session.total_fetches, 1)
+
+    def test_matches_get_submissions(self):
+        session = canvas_requests.CourseSession('ron', 15)
+        self.assertEqual(session.get_submissions(),
+                         canvas_requests.get_submissions('ron', 15))
+
+
+QUIZZES = {'id': 1, 'name': 'Quizzes', 'group_weight': 10}
+
+
+def quiz_submission(assignment_id, score=3):
+    return {'assignment_id': assignment_id, 'user_id': 5, 'score': score,
+            'assignment': {'id': assignment_id, 'assignment_group_id': 1}}
+
+
+def course_pages(course_ids, score=3):
+    pages = {}
+    for course_id in course_ids:
+        pages['courses/{}/students/submissions'.format(course_id)] = [
+            [quiz_submission(course_id, score)]]
+        pages['courses/{}/assignment_groups'.format(course_id)] = [[QUIZZES]]
+    return pages
+
+
+class TestCoursePrefetcher(unittest.TestCase):
+    def setUp(self):
+        canvas_requests.GROUP_INDEX.invalidate()
+
+    def test_chosen_course_already_fetched(self):
+        with StandInCanvas(course_pages([7, 8])) as canvas:
+            with canvas_requests.CoursePrefetcher('live-token', [7, 8]) as prefetcher:
+                session = prefetcher.session(8)
+                fetched = len(canvas.requests)
+                submissions = session.get_submissions()
+        self.assertEqual(session.total_fetches, 1)
+        self.assertEqual(len(canvas.requests), fetched)
+        self.assertEqual(submissions[0]['assignment']['group']['name'], 'Quizzes')
+
+    def test_cancel_skips_courses_not_started(self):
+        with StandInCanvas(course_pages([7, 8, 9]), delay=0.1) as canvas:
+            prefetcher = canvas_requests.CoursePrefetcher('live-token', [7, 8, 9],
+                                                          workers=1)
+            time.sleep(0.05)
+            prefetcher.cancel()
+            session = prefetcher.session(9)
+            self.assertEqual(session.total_fetches, 0)
+            session.get_submissions()
+            time.sleep(0.25)
+        paths = {path for path, page in canvas.requests}
+        self.assertIn('courses/7/students/submissions', paths)
+        self.assertNotIn('courses/8/students/submissions', paths)
+
+    def test_failed_prefetch_retried_in_caller(self):
+        with StandInCanvas({}):
+            with canvas_requests.CoursePrefetcher('live-token', [7]) as prefetcher:
+                session = prefetcher.session(7)
+                with self.assertRaises(canvas_requests.CanvasException):
+                    session.get_submissions()
+
+
+class TestSubmissionRecords(unittest.TestCase):
+    def test_groups_shared_not_copied(self):
+        records = canvas_requests.get_submission_records('hermione', 52)
+        groups = {}
+        for record in records:
+            group = record['assignment']['group']
+            self.assertIs(groups.setdefault(group.id, group), group)
+        self.assertEqual(len(groups), 6)
+
+    def test_reads_like_get_submissions(self):
+        dicts = canvas_requests.get_submissions('harry', 23)
+        records = canvas_requests.get_submission_records('harry', 23)
+        self.assertEqual(len(records), len(dicts))
+        for record, submission in zip(records, dicts):
+            for key in record:
+                if key != 'assignment':
+                    self.assertEqual(record[key], submission[key])
+            for key in ['points_possible', 'due_at', 'name']:
+                self.assertEqual(record['assignment'][key],
+                                 submission['assignment'][key])
+            group = record['assignment']['group']
+            self.assertEqual(dict(group.items()),
+                             {key: submission['assignment']['group'][key]
+                              for key in group})
+
+    def test_compact(self):
+        record = canvas_requests.get_submission_records('ron', 15)[0]
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertNotIn('attempt', record)
+        self.assertIsNone(record.get('attempt'))
+        with self.assertRaises(KeyError):
+            record['attempt']
+
+
+class TestGroupIndex(unittest.TestCase):
+    def setUp(self):
+        canvas_requests.GROUP_INDEX.invalidate()
+        self.fetches = canvas_requests.GROUP_INDEX.fetches
+
+    def test_groups_fetched_once_per_course(self):
+        for user_id in ['ron', 'hermione', 'neville', 'harry']:
+            submissions = canvas_requests.get_submissions(user_id, 52)
+            groups = canvas_requests.get('courses/52/assignment_groups', user_id)
+            expected = canvas_requests._attach_groups(
+                canvas_requests.get('courses/52/students/submissions', user_id), groups)
+            self.assertEqual(submissions, expected)
+        canvas_requests.get_submission_records('ron', 52)
+        list(canvas_requests.iter_submissions('harry', 52))
+        self.assertEqual(canvas_requests.GROUP_INDEX.fetches - self.fetches, 1)
+        canvas_requests.GROUP_INDEX.invalidate(52)
+        canvas_requests.get_submissions('ron', 52)
+        self.assertEqual(canvas_requests.GROUP_INDEX.fetches - self.fetches, 2)
+
+    def test_every_submissions_path_shares_the_index(self):
+        canvas_requests.CourseSession('ron', 52).get_submissions()
+        asyncio.run(canvas_requests.async_get_submissions('hermione', 52))
+        canvas_requests.sync_submissions('harry', 52)
+        canvas_requests.GROUP_INDEX.get('neville', 52)
+        self.assertEqual(canvas_requests.GROUP_INDEX.fetches - self.fetches, 1)
+        canvas_requests.GROUP_INDEX.invalidate()
+        self.assertEqual(canvas_requests.GROUP_INDEX._courses, {})
+
+    def test_invalidated_during_fetch(self):
+        index = canvas_requests.GroupIndex()
+        groups = canvas_requests.get('courses/52/assignment_groups', 'ron')
+
+        def get(url, user):
+            # The weights change while the first fetch is on its way
+            index.invalidate(52)
+            return groups
+
+        with patch('canvas_requests.get', get):
+            index.get('ron', 52)
+        index.get('ron', 52)
+        self.assertEqual(index.fetches, 2)
+        self.assertEqual(len(index._courses), 1)
+
+    def test_live_groups_expire(self):
+        index = canvas_requests.GroupIndex()
+        with StandInCanvas(course_pages([7])):
+            index.get('live-token', 7)
+            index.get('live-token', 7)
+            self.assertEqual(index.fetches, 1)
+            canvas_requests.configure_cache(ttl=-1)
+            try:
+                index.get('live-token', 7)
+                index.get('ron', 52)
+                index.get('ron', 52)
+            finally:
+                canvas_requests.configure_cache(ttl=60 * 60)
+        self.assertEqual(index.fetches, 3)
+
+    def test_concurrent_students_share_one_fetch(self):
+        with StandInCanvas(course_pages([7]), delay=0.05) as canvas:
+            threads = [threading.Thread(target=canvas_requests.get_submissions,
+                                        args=('token{}'.format(i), 7))
+                       for i in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        paths = [path for path, page in canvas.requests]
+        self.assertEqual(paths.count('courses/7/assignment_groups'), 1)
+        self.assertEqual(paths.count('courses/7/students/submissions'), 6)
+
+
+class TestStreaming(unittest.TestCase):
+    def test_matches_get_submissions(self):
+        stream = canvas_requests.iter_submissions('hermione', 52)
+        self.assertIsInstance(stream, types.GeneratorType)
+        self.assertEqual(list(stream),
+                         canvas_requests.get_submissions('hermione', 52))
+
+    def test_json_array_decoding(self):
+        decode = canvas_requests._iter_json_array
+        self.assertEqual(list(decode(' [ ]')), [])
+        self.assertEqual(list(decode('[{"a": [1, 2]} ,\n 3,"x"]')),
+                         [{'a': [1, 2]}, 3, 'x'])
+        with self.assertRaises(ValueError):
+            list(decode('{"a": 1}'))
+        with self.assertRaises(ValueError):
+            list(decode('[1 2]'))
+
+    def test_pages_requested_as_needed(self):
+        pages = course_pages([7])
+        pages['courses/7/students/submissions'] = [[quiz_submission(1, score=page)]
+                                                   for page in range(3)]
+        with StandInCanvas(pages) as canvas:
+            stream = canvas_requests.iter_submissions('live-token', 7)
+            first = next(stream)
+            requested = list(canvas.requests)
+            rest = list(stream)
+        self.assertEqual(first['assignment']['group'], QUIZZES)
+        self.assertEqual(requested, [('courses/7/assignment_groups', 1),
+                                     ('courses/7/students/submissions', 1)])
+        self.assertEqual([s['score'] for s in rest], [1, 2])
+
+
+class TestSyncSubmissions(unittest.TestCase):
+    def setUp(self):
+        self.cache = TemporaryCache()
+        self.cache.__enter__()
+        canvas_requests.GROUP_INDEX.invalidate()
+
+    def tearDown(self):
+        canvas_requests.configure_memory_cache(max_entries=0)
+        self.cache.__exit__()
+
+    def test_only_changes_downloaded(self):
+        submissions = [quiz_submission(i, score=None) for i in range(3)]
+        pages = course_pages([7])
+        pages['courses/7/students/submissions'] = [submissions]
+        with StandInCanvas(pages) as canvas:
+            first, changes = canvas_requests.sync_submissions('live-token', 7)
+            self.assertIsNone(changes)
+            self.assertNotIn('graded_since', canvas.queries[-1])
+            graded = dict(submissions[1], score=4)
+            new = quiz_submission(3, score=2)
+            pages['courses/7/students/submissions'] = [[graded, new]]
+            second, changes = canvas_requests.sync_submissions('live-token', 7)
+            self.assertIn('graded_since', canvas.queries[-1])
+        self.assertEqual([s['score'] for s in second], [None, 4, None, 2])
+        self.assertEqual([(old and old['score'], new['score'])
+                          for old, new in changes], [(None, 4), (None, 2)])
+        self.assertIsNone(changes[1][0])
+        self.assertEqual(changes[0][0]['assignment']['group'], QUIZZES)
+        self.assertEqual(second[3]['assignment']['group'], QUIZZES)
+
+    def test_memory_cache_updated(self):
+        canvas_requests.configure_memory_cache(max_entries=8)
+        pages = course_pages([7], score=None)
+        with StandInCanvas(pages) as canvas:
+            canvas_requests.sync_submissions('live-token', 7)
+            canvas_requests.get_submissions('live-token', 7)
+            pages['courses/7/students/submissions'] = [[quiz_submission(7, score=4)]]
+            canvas_requests.sync_submissions('live-token', 7)
+            submissions = canvas_requests.get_submissions('live-token', 7)
+        self.assertEqual([s['score'] for s in submissions], [4])
+        self.assertEqual(canvas.requests.count(('courses/7/assignment_groups', 1)), 1)
+
+    def test_resync_after_clearing(self):
+        canvas_requests.configure_cache(write_through=True, max_bytes=1)
+        try:
+            with StandInCanvas(course_pages([7])) as canvas:
+                canvas_requests.sync_submissions('live-token', 7)
+                # The stored response is evicted, but the sync keeps its copy
+                _, changes = canvas_requests.sync_submissions('live-token', 7)
+                self.assertEqual([(old['score'], new['score'])
+                                  for old, new in changes], [(3, 3)])
+                self.assertIn('graded_since', canvas.queries[-1])
+                canvas_requests.clear_live_cache()
+                submissions, changes = canvas_requests.sync_submissions('live-token', 7)
+                self.assertNotIn('graded_since', canvas.queries[-1])
+        finally:
+            canvas_requests.configure_cache(write_through=False,
+                                            max_bytes=64 * 1024 * 1024)
+        self.assertIsNone(changes)
+        self.assertEqual([s['score'] for s in submissions], [3])
+
+    def test_sample_users_not_synced(self):
+        submissions, changes = canvas_requests.sync_submissions('ron', 15)
+        self.assertEqual(submissions, canvas_requests.get_submissions('ron', 15))
+        self.assertEqual(changes, [])
+
+
+class TestCacheIndex(unittest.TestCase):
+    def test_lookup_uses_index(self):
+        with TemporaryCache() as database:
+            canvas_requests._ensure_cache_index(database)
+            plan = database.execute(
+                "EXPLAIN QUERY PLAN " + canvas_requests._CACHE_QUERY,
+                ('courses', 'ron')).fetchall()
+        self.assertIn('responses_user_url', str(plan))
+
+    def test_empty_cached_response(self):
+        with TemporaryCache():
+            self.assertEqual(canvas_requests._get_via_cache(
+                'courses/44/students/submissions', 'ron'), [[]])
+            self.assertEqual(canvas_requests._get_via_cache('courses/99', 'ron'), [])
+            self.assertFalse(canvas_requests._get_via_cache('courses', 'luna'))
+
+
+class TestLazyDatabase(unittest.TestCase):
+    def run_without_cache_file(self, code):
+        with tempfile.TemporaryDirectory() as directory:
+            environment = dict(os.environ, PYTHONPATH=os.path.dirname(
+                os.path.abspath(canvas_requests.__file__)))
+            environment.pop('CANVAS_DATABASE', None)
+            output = subprocess.check_output([sys.executable, '-c', code],
+                                             cwd=directory, env=environment,
+                                             universal_newlines=True)
+            self.assertEqual(os.listdir(directory), [])
+        return output.split()
+
+    def test_import_does_not_touch_disk(self):
+        output = self.run_without_cache_file(
+            "import canvas_requests\n"
+            "print(canvas_requests._DATABASE, canvas_requests._USERS)\n"
+            "print(canvas_requests._get_via_cache('courses', 'ron'))")
+        self.assertEqual(output, ['None', 'None', 'False'])
+
+    def test_missing_cache_file_still_explained(self):
+        output = self.run_without_cache_file(
+            "import canvas_requests\n"
+            "canvas_requests.configure_cache(write_through=True)\n"
+            "try:\n"
+            "    canvas_requests._get_via_cache('courses', 'live-token')\n"
+            "except canvas_requests.CanvasException as error:\n"
+            "    print(type(error).__name__)")
+        self.assertEqual(output, ['CanvasException'])
+
+    def test_live_token_leaves_cache_closed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.db')
+            database = sqlite3.connect(path)
+            database.execute("CREATE TABLE users (name text)")
+            database.execute("INSERT INTO users VALUES ('ron')")
+            database.execute("CREATE TABLE responses (url text, user text, response text)")
+            database.commit()
+            saved = (canvas_requests.DATABASE_NAME, canvas_requests._DATABASE,
+                     canvas_requests._USERS)
+            canvas_requests.DATABASE_NAME = path
+            canvas_requests._DATABASE = canvas_requests._USERS = None
+            try:
+                with StandInCanvas({'courses': [[{'id': 1}]]}):
+                    for _ in range(2):
+                        canvas_requests.get('courses', 'live-token')
+                self.assertIsNone(canvas_requests._DATABASE)
+                self.assertEqual(canvas_requests._USERS, {'ron'})
+            finally:
+                (canvas_requests.DATABASE_NAME, canvas_requests._DATABASE,
+                 canvas_requests._USERS) = saved
+            schema = database.execute("SELECT name FROM sqlite_master").fetchall()
+            database.close()
+        self.assertEqual(sorted(schema), [('responses',), ('users',)])
+
+    def test_users_loaded_once_as_set(self):
+        self.assertIsInstance(canvas_requests.USERS, set)
+        self.assertIs(canvas_requests.USERS, canvas_requests._get_users())
+        self.assertEqual(canvas_requests.USERS,
+                         {'ron', 'hermione', 'neville', 'harry'})
+
+
+class TestPooledHttp(unittest.TestCase):
+    def test_pages_share_one_connection(self):
+        pages = [[{'id': i}] for i in range(5)]
+        with StandInCanvas({'courses': pages}) as canvas:
+            first = canvas_requests.get('courses', 'live-token')
+            second = canvas_requests.get('courses', 'live-token')
+        self.assertEqual(first, [{'id': i} for i in range(5)])
+        self.assertEqual(second, first)
+        self.assertEqual(len(canvas.requests), 10)
+        self.assertEqual(canvas.connections, 1)
+
+    def test_retries_server_errors(self):
+        with StandInCanvas({'users/self/profile': [{'name': 'Luna'}]},
+                           failures=2) as canvas:
+            profile = canvas_requests.get_user('live-token')
+        self.assertEqual(profile, {'name': 'Luna'})
+        self.assertEqual(len(canvas.requests), 3)
+
+    def test_missing_url(self):
+        with StandInCanvas({}):
+            with self.assertRaises(canvas_requests.CanvasException):
+                canvas_requests.get('courses/99', 'live-token')
+
+    def test_invalid_token_not_quoted(self):
+        token = '1234~SecretToken'
+        pages = {'courses': [{'errors': [{'message': 'Invalid access token.'}]}]}
+        with StandInCanvas(pages):
+            with self.assertRaises(canvas_requests.CanvasException) as caught:
+                canvas_requests.get('courses', token)
+        self.assertNotIn(token, str(caught.exception))
+        self.assertIn(canvas_requests.describe_user(token), str(caught.exception))
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        canvas_requests.METRICS.reset()
+        canvas_requests.GROUP_INDEX.invalidate()
+        canvas_requests.configure_metrics(enabled=True)
+
+    def tearDown(self):
+        canvas_requests.configure_metrics(enabled=False)
+        canvas_requests.METRICS.reset()
+
+    def test_cached_lookups(self):
+        events = []
+        listener = lambda *event: events.append(event)
+        canvas_requests.METRICS.add_listener(listener)
+        try:
+            canvas_requests.get_submissions('hermione', 52)
+            canvas_requests.get_submissions('hermione', 15)
+        finally:
+            canvas_requests.METRICS.remove_listener(listener)
+        submissions = canvas_requests.METRICS.endpoints['courses/:id/students/submissions']
+        self.assertEqual(sorted(submissions), ['cache hit', 'decode', 'sqlite'])
+        self.assertEqual(submissions['cache hit']['count'], 2)
+        self.assertGreater(submissions['decode']['bytes'], 0)
+        self.assertEqual(len(events), 12)
+        self.assertEqual(events[0][:2], ('courses/:id/students/submissions', 'sqlite'))
+        summary = canvas_requests.METRICS.summary()
+        self.assertIn('courses/:id/assignment_groups', summary)
+
+    def test_pages_and_retries(self):
+        pages = [[{'id': i}] for i in range(3)]
+        with StandInCanvas({'courses': pages}, failures=1):
+            canvas_requests.get('courses', 'live-token')
+        courses = canvas_requests.METRICS.endpoints['courses']
+        self.assertEqual(courses['cache miss']['count'], 1)
+        self.assertEqual(courses['page']['count'], 3)
+        self.assertEqual(courses['page']['retries'], 1)
+        self.assertEqual(courses['page']['bytes'], len(json.dumps([{'id': 0}])) * 3)
+
+    def test_summary_at_exit(self):
+        code = "import canvas_requests; canvas_requests.get_user('ron')"
+        with TemporaryCache() as database:
+            path, = [name for _, _, name in database.execute("PRAGMA database_list")]
+            environment = dict(os.environ, CANVAS_DATABASE=path)
+            result = subprocess.run([sys.executable, '-c', code],
+                                    env=dict(environment, CANVAS_METRICS='1'),
+                                    stderr=subprocess.PIPE, universal_newlines=True)
+            self.assertIn("Canvas request metrics:", result.stderr)
+            self.assertIn("users/self/profile", result.stderr)
+            result = subprocess.run([sys.executable, '-c', code], env=environment,
+                                    stderr=subprocess.PIPE, universal_newlines=True)
+            self.assertEqual(result.stderr, "")
+
+
+class TestCoalescing(unittest.TestCase):
+    def get_together(self, count, url):
+        results, errors = [], []
+        barrier = threading.Barrier(count)
+
+        def get():
+            barrier.wait()
+            try:
+                results.append(canvas_requests.get(url, 'live-token'))
+            except canvas_requests.CanvasException as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=get) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_identical_requests_share_one_fetch(self):
+        coalesced = canvas_requests.COALESCER.coalesced
+        pages = [[{'id': i}] for i in range(2)]
+        with StandInCanvas({'courses': pages}, delay=0.2) as canvas:
+            results, errors = self.get_together(5, 'courses')
+        self.assertEqual(len(canvas.requests), 2)
+        self.assertEqual(canvas_requests.COALESCER.coalesced - coalesced, 4)
+        self.assertEqual(results, [[{'id': 0}, {'id': 1}]] * 5)
+        # Every caller has its own copy to change
+        self.assertEqual(len({id(result) for result in results}), 5)
+
+    def test_errors_shared(self):
+        with StandInCanvas({}, delay=0.2) as canvas:
+            results, errors = self.get_together(3, 'courses/99')
+        self.assertEqual(len(canvas.requests), 1)
+        self.assertEqual(len(errors), 3)
+
+    def test_disabled(self):
+        canvas_requests.configure_coalescing(False)
+        try:
+            with StandInCanvas({'courses': [[]]}, delay=0.1) as canvas:
+                self.get_together(3, 'courses')
+        finally:
+            canvas_requests.configure_coalescing(True)
+        self.assertEqual(len(canvas.requests), 3)
+
+
+class TestRateLimits(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = canvas_requests.SCHEDULER
+        canvas_requests.SCHEDULER = canvas_requests.RateLimitScheduler(
+            reserve=3, delay=0.1, max_delay=0.4)
+
+    def tearDown(self):
+        canvas_requests.SCHEDULER = self.scheduler
+
+    def get_all(self, jobs, workers):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda job: canvas_requests.get(*job), jobs))
+
+    def test_roster_job_stays_within_limits(self):
+        canvas_requests.configure_coalescing(False)
+        bucket = LeakyBucket(capacity=3, leak_rate=20)
+        pages = {'courses/{}'.format(i): [{'id': i}] for i in range(30)}
+        try:
+            with StandInCanvas(pages, delay=0.01, bucket=bucket):
+                results = self.get_all([('courses/{}'.format(i % 30), 'token{}'.format(i % 2))
+                                        for i in range(24)], workers=12)
+        finally:
+            canvas_requests.configure_coalescing(True)
+        self.assertEqual(results, [{'id': i % 30} for i in range(24)])
+        self.assertGreater(canvas_requests.SCHEDULER.paused, 0)
+        self.assertEqual(canvas_requests.SCHEDULER.throttled, bucket.throttled)
+        self.assertLessEqual(bucket.throttled, 2)
+
+    def test_limit_follows_quota(self):
+        scheduler = canvas_requests.SCHEDULER
+        scheduler.IN_FLIGHT_COST = 0
+        # Until the first answer, the quota is unknown
+        self.assertEqual(scheduler.limit('token'), 1)
+        for remaining, limit in [(700, 10), (8, 5), (3, 1)]:
+            scheduler.acquire('token')
+            response = types.SimpleNamespace(
+                status_code=200, content=b'[]',
+                headers={'X-Rate-Limit-Remaining': str(remaining), 'X-Request-Cost': '1'})
+            scheduler.release('token', response)
+            self.assertEqual(scheduler.limit('token'), limit)
+        self.assertEqual(scheduler.limit('other'), 1)
+
+    def test_users_take_turns(self):
+        canvas_requests.configure_rate_limits(max_concurrent=1)
+        pages = {'courses/{}'.format(i): [{'id': i}] for i in range(8)}
+        with StandInCanvas(pages, delay=0.02) as canvas:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                for i in range(6):
+                    pool.submit(canvas_requests.get, 'courses/{}'.format(i), 'busy')
+                time.sleep(0.01)
+                for i in [6, 7]:
+                    pool.submit(canvas_requests.get, 'courses/{}'.format(i), 'other')
+        tokens = [query['access_token'][0] for query in canvas.queries]
+        self.assertEqual(tokens.count('other'), 2)
+        # The other user does not wait for all of the busy user's requests
+        self.assertLessEqual(len(tokens) - 1 - tokens[::-1].index('other'), 4)
+
+    def test_always_throttled(self):
+        canvas_requests.configure_rate_limits(throttle_retries=2)
+        canvas_requests.configure_http(retries=0)
+        canvas_requests.METRICS.reset()
+        canvas_requests.configure_metrics(enabled=True)
+        try:
+            with StandInCanvas({'courses': [[]]}, bucket=LeakyBucket(0, 0)) as canvas:
+                with self.assertRaises(canvas_requests.CanvasException):
+                    canvas_requests.get('courses', 'live-token')
+        finally:
+            canvas_requests.configure_metrics(enabled=False)
+            canvas_requests.configure_http(retries=3)
+        self.assertEqual(len(canvas.requests), 3)
+        self.assertEqual(canvas_requests.METRICS.endpoints['courses']['throttled']['count'], 3)
+        canvas_requests.METRICS.reset()
+
+
+class TestParallelPages(unittest.TestCase):
+    def setUp(self):
+        canvas_requests.configure_http(parallel_pages=4)
+
+    def tearDown(self):
+        canvas_requests.configure_http(parallel_pages=1)
+
+    def test_pages_fetched_concurrently_in_order(self):
+        pages = [[{'id': i}, {'id': i + 100}] for i in range(9)]
+        with StandInCanvas({'courses': pages}, delay=0.05) as canvas:
+            result = canvas_requests.get('courses', 'live-token')
+        self.assertEqual(result, [item for page in pages for item in page])
+        self.assertEqual(sorted(page for _, page in canvas.requests),
+                         list(range(1, 10)))
+        self.assertGreater(canvas.most_in_flight, 1)
+        self.assertLessEqual(canvas.most_in_flight, 4)
+
+    def test_remaining_page_urls(self):
+        links = {'next': {'url': 'http://x/api/v1/courses?page=2&per_page=100'},
+                 'last': {'url': 'http://x/api/v1/courses?page=4&per_page=100'}}
+        self.assertEqual(canvas_requests._remaining_page_urls(links),
+                         ['http://x/api/v1/courses?page=2&per_page=100',
+                          'http://x/api/v1/courses?page=3&per_page=100',
+                          'http://x/api/v1/courses?page=4&per_page=100'])
+
+    def test_bookmark_pages_stay_serial(self):
+        links = {'next': {'url': 'http://x/api/v1/courses?page=bookmark:abc'},
+                 'last': {'url': 'http://x/api/v1/courses?page=bookmark:xyz'}}
+        self.assertIsNone(canvas_requests._remaining_page_urls(links))
+        self.assertIsNone(canvas_requests._remaining_page_urls(
+            {'next': links['next']}))
+
+
+class TestAsyncApi(unittest.TestCase):
+    def setUp(self):
+        canvas_requests.GROUP_INDEX.invalidate()
+
+    def test_matches_blocking_api(self):
+        async def analyze(user_id, course_id):
+            return await asyncio.gather(
+                canvas_requests.async_get_user(user_id),
+                canvas_requests.async_get_courses(user_id),
+                canvas_requests.async_get_submissions(user_id, course_id))
+
+        async def analyze_all():
+            return await asyncio.gather(analyze('hermione', 52),
+                                        analyze('ron', 15),
+                                        analyze('harry', 23))
+
+        results = asyncio.run(analyze_all())
+        for (user_id, course_id), result in zip([('hermione', 52), ('ron', 15),
+                                                 ('harry', 23)], results):
+            self.assertEqual(result,
+                             [canvas_requests.get_user(user_id),
+                              canvas_requests.get_courses(user_id),
+                              canvas_requests.get_submissions(user_id,
+                                                              course_id)])
+
+    def test_submissions_and_groups_requested_together(self):
+        with StandInCanvas(course_pages([7]), delay=0.1) as canvas:
+            result = asyncio.run(
+                canvas_requests.async_get_submissions('live-token', 7))
+        self.assertEqual(result[0]['assignment']['group'], QUIZZES)
+        self.assertEqual(canvas.most_in_flight, 2)
+
+    def test_lookups_limited_to_async_workers(self):
+        async def fetch_all():
+            return await asyncio.gather(*[
+                canvas_requests.async_get('courses', 'token-{}'.format(i))
+                for i in range(6)])
+
+        canvas_requests.configure_http(async_workers=2)
+        try:
+            with StandInCanvas({'courses': [[{'id': 7}]]}, delay=0.1) as canvas:
+                results = asyncio.run(fetch_all())
+        finally:
+            canvas_requests.configure_http(async_workers=0)
+        self.assertEqual(results, [[{'id': 7}]] * 6)
+        self.assertEqual(canvas.most_in_flight, 2)
+
+
+class TestWriteThroughCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = TemporaryCache()
+        self.database = self.cache.__enter__()
+        canvas_requests.configure_cache(write_through=True, ttl=60)
+
+    def tearDown(self):
+        canvas_requests.configure_cache(write_through=False, ttl=60 * 60,
+                                        max_bytes=64 * 1024 * 1024)
+        self.cache.__exit__()
+
+    def test_live_response_served_from_disk(self):
+        pages = {'courses': [[{'id': 1}], [{'id': 2}]]}
+        with StandInCanvas(pages) as canvas:
+            first = canvas_requests.get('courses', 'Live-Token')
+            second = canvas_requests.get('Courses/', 'Live-Token')
+        self.assertEqual(first, [{'id': 1}, {'id': 2}])
+        self.assertEqual(second, first)
+        self.assertEqual(len(canvas.requests), 2)
+        users = [user for user, in self.database.execute(
+            "SELECT user FROM responses WHERE fetched_at IS NOT NULL")]
+        self.assertEqual(len(users), 1)
+        self.assertTrue(users[0].startswith('token:'))
+        self.assertNotIn('Live-Token', users[0])
+
+    def test_expired_response_refetched(self):
+        canvas_requests.configure_cache(ttl=0)
+        with StandInCanvas({'courses': [[{'id': 1}]]}) as canvas:
+            canvas_requests.get('courses', 'live-token')
+            time.sleep(0.01)
+            canvas_requests.get('courses', 'live-token')
+        self.assertEqual(len(canvas.requests), 2)
+        count, = self.database.execute(
+            "SELECT COUNT(*) FROM responses WHERE fetched_at IS NOT NULL").fetchone()
+        self.assertEqual(count, 1)
+
+    def test_oldest_evicted_beyond_max_bytes(self):
+        canvas_requests.configure_cache(max_bytes=25)
+        pages = {'courses/{}/assignment_groups'.format(i): [[{'id': i}]]
+                 for i in range(5)}
+        with StandInCanvas(pages):
+            for i in range(5):
+                canvas_requests.get('courses/{}/assignment_groups'.format(i),
+                                    'live-token')
+        urls = [url for url, in self.database.execute(
+            "SELECT url FROM responses WHERE fetched_at IS NOT NULL")]
+        self.assertEqual(sorted(urls), ['courses/3/assignment_groups',
+                                        'courses/4/assignment_groups'])
+        canvas_requests.clear_live_cache()
+        count, = self.database.execute(
+            "SELECT COUNT(*) FROM responses WHERE fetched_at IS NOT NULL").fetchone()
+        self.assertEqual(count, 0)
+
+    def test_sizes_recorded_for_eviction(self):
+        canvas_requests.configure_cache(max_bytes=30)
+        pages = {'courses/1/assignment_groups': [[{'name': 'Exams'}]],
+                 'courses/2/assignment_groups': [[{'name': 'Quizzes'}]]}
+        with StandInCanvas(pages):
+            for url in sorted(pages):
+                canvas_requests.get(url, 'live-token')
+        sizes = dict(self.database.execute(
+            "SELECT url, size FROM responses WHERE fetched_at IS NOT NULL"))
+        self.assertEqual(sizes, {'courses/2/assignment_groups': 21})
+        self.assertEqual(self.database.live_bytes, 21)
+        plan = self.database.execute(
+            """EXPLAIN QUERY PLAN SELECT rowid, size FROM responses
+               WHERE fetched_at IS NOT NULL ORDER BY fetched_at""").fetchall()
+        self.assertIn('COVERING INDEX responses_fetched_at', str(plan))
+
+    def test_expired_response_revalidated(self):
+        canvas_requests.configure_cache(ttl=-1)
+        canvas_requests.METRICS.reset()
+        canvas_requests.configure_metrics(enabled=True)
+        pages = {'courses': [[{'id': 1}]]}
+        try:
+            with StandInCanvas(pages, validators=True) as canvas:
+                first = canvas_requests.get('courses', 'live-token')
+                second = canvas_requests.get('courses', 'live-token')
+                pages['courses'] = [[{'id': 2}]]
+                third = canvas_requests.get('courses', 'live-token')
+                fourth = canvas_requests.get('courses', 'live-token')
+        finally:
+            canvas_requests.configure_metrics(enabled=False)
+        self.assertEqual([first, second, third, fourth],
+                         [[{'id': 1}], [{'id': 1}], [{'id': 2}], [{'id': 2}]])
+        etags = [etag for etag, since in canvas.conditional]
+        self.assertIsNone(etags[0])
+        self.assertEqual(etags[1], etags[2])
+        self.assertNotEqual(etags[3], etags[2])
+        self.assertEqual(canvas.conditional[1][1], 'Wed, 21 Oct 2026 07:28:00 GMT')
+        courses = canvas_requests.METRICS.endpoints['courses']
+        self.assertEqual(courses['not modified']['count'], 2)
+        self.assertEqual(courses['revalidated']['bytes_saved'],
+                         len(json.dumps([{'id': 1}])) + len(json.dumps([{'id': 2}])))
+        canvas_requests.METRICS.reset()
+
+    def test_multiple_pages_not_revalidated(self):
+        canvas_requests.configure_cache(ttl=-1)
+        pages = {'courses': [[{'id': 1}], [{'id': 2}]]}
+        with StandInCanvas(pages, validators=True) as canvas:
+            canvas_requests.get('courses', 'live-token')
+            second = canvas_requests.get('courses', 'live-token')
+        self.assertEqual(second, [{'id': 1}, {'id': 2}])
+        self.assertEqual(canvas.conditional, [(None, None)] * 4)
+
+    def test_sample_users_untouched(self):
+        self.assertEqual(canvas_requests.get_user('ron')['name'],
+                         'Ron Weasley')
+        columns = [column[1] for column in
+                   self.database.execute("PRAGMA table_info(responses)")]
+        self.assertNotIn('fetched_at', columns)
+        self.assertFalse(self.database.live_schema)
+
+
+class TestMemoryCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = TemporaryCache()
+        self.cache.__enter__()
+        canvas_requests.configure_memory_cache(max_entries=8)
+
+    def tearDown(self):
+        canvas_requests.configure_memory_cache(max_entries=0)
+        cache = canvas_requests.MEMORY_CACHE
+        cache.hits = cache.misses = 0
+        self.cache.__exit__()
+
+    def test_repeat_get_skips_sqlite(self):
+        cache = canvas_requests.MEMORY_CACHE
+        expected = canvas_requests.get('courses', 'hermione')
+        with patch('canvas_requests._get_via_cache') as get_via_cache:
+            self.assertEqual(canvas_requests.get('courses/', 'Hermione'),
+                             expected)
+        get_via_cache.assert_not_called()
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_mutating_results_is_safe(self):
+        first = canvas_requests.get_submissions('ron', 15)
+        first[0]['score'] = -1
+        first[0]['assignment'].clear()
+        second = canvas_requests.get_submissions('ron', 15)
+        self.assertNotEqual(second[0]['score'], -1)
+        self.assertIn('group', second[0]['assignment'])
+        # The groups come from the group index the second time
+        self.assertEqual(canvas_requests.MEMORY_CACHE.hits, 1)
+
+    def test_limits(self):
+        cache = canvas_requests.MemoryCache(max_entries=2, max_bytes=10)
+        cache.put(('a', 'ron'), [1], 3)
+        cache.put(('b', 'ron'), [2], 3)
+        self.assertEqual(cache.get(('a', 'ron')), [1])
+        cache.put(('c', 'ron'), [3], 3)
+        self.assertIs(cache.get(('b', 'ron')), canvas_requests.MISSING)
+        cache.put(('d', 'ron'), [4], 8)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 8)
+        cache.put(('e', 'ron'), [5], 11)
+        self.assertIs(cache.get(('e', 'ron')), canvas_requests.MISSING)
+
+    def test_max_age(self):
+        cache = canvas_requests.MemoryCache(max_entries=2, max_age=0)
+        cache.put(('a', 'ron'), [1], 3)
+        time.sleep(0.01)
+        self.assertIs(cache.get(('a', 'ron')), canvas_requests.MISSING)
+        self.assertEqual(cache.size, 0)
+
+    def test_invalidate(self):
+        canvas_requests.get('courses', 'ron')
+        canvas_requests.get('courses', 'harry')
+        canvas_requests.get('users/self/profile', 'ron')
+        canvas_requests.MEMORY_CACHE.invalidate(user='RON')
+        self.assertEqual(len(canvas_requests.MEMORY_CACHE), 1)
+        canvas_requests.MEMORY_CACHE.invalidate(url='courses/')
+        self.assertEqual(len(canvas_requests.MEMORY_CACHE), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()